@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+r"""
+Сравнение точности и времени обучения моделей ``Nesterov`` (ARIMA и AR)
+на истории: модель обучается на данных региона до дня отсечения
+и прогнозирует число новых заболевших на horizon дней вперед.
+
+Примеры::
+
+    python benchmarks/backtest.py
+    python benchmarks/backtest.py --all --cutoffs 4 --horizon 14
+"""
+import argparse
+import csv
+import statistics
+import time
+import warnings
+
+from common import DUMP_PATH, load_region
+
+MODELS = ('ARIMA', 'AR')
+REGIONS = ('Москва', 'Московская область', 'Санкт-Петербург')
+
+
+def regions():
+    r"""Возвращает названия всех регионов из data/dump_cities.csv."""
+    with open(DUMP_PATH, encoding='utf-8') as f:
+        reader = csv.reader(f, delimiter=';')
+        next(reader)
+        return list(dict.fromkeys(row[1] for row in reader))
+
+
+def backtest(data, model, cutoffs, horizon, step):
+    r"""
+    Обучает модель Nesterov(model=model) на данных до каждого из cutoffs
+    дней отсечения (последний -- за horizon дней до конца данных,
+    остальные -- с шагом step дней раньше) и сравнивает прогноз новых
+    заболевших с реальными данными.
+
+    :return: список словарей {'fit', 'errors', 'actual'} либо
+        {'failed': исключение} по дням отсечения
+    :rtype: list
+    """
+    from covidlib import Nesterov
+
+    keys = sorted(data)
+    results = []
+    for cutoff in range(cutoffs):
+        end = len(keys) - horizon - cutoff * step
+        if end < 30:
+            break
+        train = {i: data[key] for i, key in enumerate(keys[:end])}
+        test = [data[key] for key in keys[end:end + horizon]]
+
+        approximator = Nesterov(model=model)
+        start = time.perf_counter()
+        try:
+            approximator.fit(train)
+            fit = time.perf_counter() - start
+            preds = approximator.predict_between(
+                test[0]['date'], test[-1]['date'], ['sick'])
+        except Exception as e:
+            results.append({'failed': e})
+            continue
+        results.append({
+            'fit': fit,
+            'errors': [pred['sick'] - real['sick']
+                       for pred, real in zip(preds, test)],
+            'actual': [real['sick'] for real in test]})
+    return results
+
+
+def summary(results):
+    r"""
+    Сводит результаты :func:`backtest`: медианное время обучения, MAE
+    и WAPE (сумма модулей ошибок, деленная на сумму реальных значений).
+
+    :rtype: dict
+    """
+    done = [result for result in results if 'failed' not in result]
+    errors = [abs(error) for result in done for error in result['errors']]
+    actual = sum(sum(result['actual']) for result in done)
+    return {'runs': len(results),
+            'failed': len(results) - len(done),
+            'fit': statistics.median(result['fit'] for result in done)
+            if done else float('nan'),
+            'mae': statistics.mean(errors) if errors else float('nan'),
+            'wape': sum(errors) / actual if actual else float('nan')}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('regions', nargs='*',
+                        help='regions as in dump_cities.csv '
+                             '(Moscow, Moscow region and Saint Petersburg '
+                             'by default)')
+    parser.add_argument('--all', action='store_true',
+                        help='all regions of dump_cities.csv')
+    parser.add_argument('--models', default=','.join(MODELS))
+    parser.add_argument('--cutoffs', type=int, default=3)
+    parser.add_argument('--horizon', type=int, default=14)
+    parser.add_argument('--step', type=int, default=14,
+                        help='days between cutoffs')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    names = regions() if args.all else args.regions or list(REGIONS)
+    models = args.models.split(',')
+    results = {model: [] for model in models}
+    for name in names:
+        data = load_region(name)
+        row = []
+        for model in models:
+            result = backtest(data, model, args.cutoffs, args.horizon,
+                              args.step)
+            results[model].extend(result)
+            row.append('{} wape {:.3f}'.format(model,
+                                               summary(result)['wape']))
+        print('{:<40} {}'.format(name, '  '.join(row)))
+
+    print()
+    print('{:<8} {:>6} {:>7} {:>10} {:>12} {:>8}'.format(
+        'model', 'runs', 'failed', 'fit, s', 'MAE', 'WAPE'))
+    for model in models:
+        total = summary(results[model])
+        print('{:<8} {:>6} {:>7} {:>10.4f} {:>12.1f} {:>8.3f}'.format(
+            model, total['runs'], total['failed'], total['fit'],
+            total['mae'], total['wape']))
+
+
+if __name__ == '__main__':
+    main()
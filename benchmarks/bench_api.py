@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import warnings
+
+from common import FLASK_DIR, measure
+
+CITY = 'RU-MOW'
+DATE = {'use_date_from': '01.06.2020',
+        'use_date_to': '01.10.2020',
+        'predict_date_to': '31.10.2020'}
+
+
+def run(repeat=3):
+    r"""
+    Замеряет чтение и подготовку данных, :func:`api._approximate` и полный
+    запрос ``/json/<city>``. Нужна локальная DynamoDB (например,
+    контейнер covid-dynamodb из docker-compose), адрес которой задается
+    переменной окружения DYNAMODB_ENDPOINT. Если таблицы пустые, они
+    заполняются из data/dump_cities.csv.
+
+    :rtype: dict
+    """
+    warnings.simplefilter('ignore')
+    os.environ.setdefault('MODELS_REGISTRY_PATH', tempfile.mkdtemp())
+    os.chdir(FLASK_DIR)
+
+    import api
+    import server
+    import covidlib
+
+    api.init_base()
+
+    def clear_caches():
+        api._approximate.cache_clear()
+        api._fit.cache_clear()
+        api.get_features.cache_clear()
+        api.ModelRegistrySingleton._registry = covidlib.ModelRegistry()
+
+    def clear_request_cache():
+        api._approximate.cache_clear()
+        api._fit.cache_clear()
+
+    models = {key: {'parameters': {
+        par: value['default'] for par, value in
+        api.get_models()[key]['parameters'].items()}}
+        for key in api.get_models()}
+    data = api.get_city_statistic(CITY)
+    time = api.get_region_version(CITY)
+
+    results = dict()
+    results['get_city_statistic'] = measure(
+        lambda: api.get_city_statistic(CITY), repeat=repeat, number=10)
+    results['prune_data'] = measure(
+        lambda: api.prune_data(data, DATE['use_date_from'],
+                               DATE['use_date_to']),
+        repeat=repeat, number=10)
+    results['features'] = measure(
+        lambda: covidlib.FeatureFrame.from_data(data).window(
+            DATE['use_date_from'], DATE['use_date_to']).grid(),
+        repeat=repeat, number=10)
+
+    for name in sorted(models):
+        args = (CITY, json.dumps({name: models[name]}),
+                json.dumps(DATE, sort_keys=True), time,
+                json.dumps(list(api.get_data_field())))
+        results['_approximate/{}/cold'.format(name)] = measure(
+            lambda: api._approximate(*args), setup=clear_caches,
+            repeat=repeat)
+        results['_approximate/{}/registry'.format(name)] = measure(
+            lambda: api._approximate(*args), setup=clear_request_cache,
+            repeat=repeat)
+        results['_approximate/{}/cached'.format(name)] = measure(
+            lambda: api._approximate(*args), repeat=repeat, number=100)
+
+    client = server.app.test_client()
+    url = '/json/{}?models={}&date={}'.format(
+        CITY,
+        json.dumps({key: dict(models[key], use=1) for key in models}),
+        json.dumps(DATE))
+    results['json/cold'] = measure(
+        lambda: client.get(url), setup=clear_caches, repeat=repeat)
+    results['json/cached'] = measure(
+        lambda: client.get(url), repeat=repeat, number=10)
+
+    return results
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import datetime
+import functools
+import warnings
+
+from common import last_days, load_region, measure
+
+HISTORY = (60, 120, 200)
+HORIZON = (7, 30, 90)
+# аппроксиматоры с параметрами не по умолчанию: имя -- (класс, параметры)
+VARIANTS = {'Nesterov[AR]': ('Nesterov', {'model': 'AR'})}
+
+
+def approximators():
+    r"""
+    Возвращает функции, создающие аппроксиматоры: все классы
+    с параметрами по умолчанию и варианты из VARIANTS.
+
+    :rtype: dict
+    """
+    from covidlib import approximator
+
+    classes = {name: cls for name, cls in vars(approximator).items()
+               if isinstance(cls, type)
+               and issubclass(cls, approximator.Approximator)
+               and cls is not approximator.Approximator}
+    factories = dict(classes)
+    for name, (cls, parameters) in VARIANTS.items():
+        factories[name] = functools.partial(classes[cls], **parameters)
+    return factories
+
+
+def run(repeat=3):
+    r"""
+    Замеряет fit и predict_between всех аппроксиматоров при разной длине
+    истории и разном горизонте прогноза.
+
+    :rtype: dict
+    """
+    warnings.simplefilter('ignore')
+    data = load_region()
+    results = dict()
+
+    for name, cls in sorted(approximators().items()):
+        for history in HISTORY:
+            train = last_days(data, history)
+            results['fit/{}/history={}'.format(name, history)] = measure(
+                lambda: cls().fit(train), repeat=repeat)
+
+            model = cls()
+            model.fit(train)
+            state = model.get_state()
+            last = datetime.datetime.strptime(
+                train[len(train) - 1]['date'], '%d.%m.%Y')
+            date_from = (last + datetime.timedelta(days=1)).strftime(
+                '%d.%m.%Y')
+
+            for horizon in HORIZON:
+                date_to = (last + datetime.timedelta(days=horizon)).strftime(
+                    '%d.%m.%Y')
+
+                def setup():
+                    # предсказание моделей Нестерова дописывает состояние,
+                    # поэтому каждый повтор начинается с только что
+                    # обученной модели
+                    model.set_state(state)
+
+                results['predict_between/{}/history={}/horizon={}'.format(
+                    name, history, horizon)] = measure(
+                    lambda: model.predict_between(date_from, date_to),
+                    setup=setup, repeat=repeat)
+
+    return results
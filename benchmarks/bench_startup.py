@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import FLASK_DIR, SRC_DIR
+
+# модули, которые не должны загружаться при импорте
+HEAVY_MODULES = ('pandas', 'scipy', 'sklearn', 'statsmodels', 'boto3',
+                 'bs4', 'requests', 'pyarrow')
+
+MODULES = ('covidlib', 'api', 'server')
+
+_CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'time': time.perf_counter() - start,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]
+                  }}))
+'''
+
+
+def import_time(module, cwd):
+    r"""
+    Импортирует module в новом интерпретаторе с рабочей директорией cwd.
+    Журнал (logs.log), хранилище, реестр моделей и выгрузка сервиса
+    создаются в cwd, а не в директории flask.
+
+    :return: время импорта и список загруженных тяжелых модулей
+    :rtype: dict
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [str(FLASK_DIR), str(SRC_DIR)]),
+        STORAGE_PATH=os.path.join(cwd, 'storage'),
+        MODELS_REGISTRY_PATH=os.path.join(cwd, 'models'),
+        EXPORT_PATH=os.path.join(cwd, 'export'))
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD.format(module=module,
+                                             heavy=HEAVY_MODULES)],
+        cwd=cwd, env=env, check=True, stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(repeat=3):
+    r"""
+    Замеряет время импорта covidlib и модулей сервиса в новом
+    интерпретаторе. Если при импорте загружаются тяжелые библиотеки
+    (pandas, scipy, sklearn, statsmodels, boto3, ...), бросает RuntimeError.
+
+    :rtype: dict
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as cwd:
+        for module in MODULES:
+            times = []
+            for _ in range(max(repeat, 5)):
+                result = import_time(module, cwd)
+                if result['heavy']:
+                    raise RuntimeError('import {} loads {}'.format(
+                        module, ', '.join(result['heavy'])))
+                times.append(result['time'])
+            results['import/{}'.format(module)] = {
+                'median': statistics.median(times), 'min': min(times),
+                'repeat': len(times), 'number': 1}
+    return results
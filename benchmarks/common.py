@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import csv
+from pathlib import Path
+import statistics
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+FLASK_DIR = ROOT / 'flask'
+SRC_DIR = ROOT / 'src'
+DUMP_PATH = FLASK_DIR / 'data' / 'dump_cities.csv'
+
+for path in (SRC_DIR, FLASK_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+
+def measure(function, setup=None, repeat=5, number=1, min_time=0.2):
+    r"""
+    Замеряет время выполнения function.
+
+    :param setup: функция, вызываемая перед каждым повтором (не замеряется)
+    :param repeat: минимальное количество повторов
+    :param number: количество вызовов function в одном повторе
+    :param min_time: быстрые функции повторяются, пока суммарное время
+        замеров не превысит min_time секунд (но не больше 1000 повторов)
+
+    :return: словарь с медианой и минимумом времени одного вызова в секундах
+    :rtype: dict
+    """
+    # первый вызов не замеряется: импорты и ленивая инициализация
+    if setup is not None:
+        setup()
+    function()
+
+    times = []
+    while len(times) < repeat or (sum(times) * number < min_time
+                                  and len(times) < 1000):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {'median': statistics.median(times), 'min': min(times),
+            'repeat': len(times), 'number': number}
+
+
+def load_region(region='Москва'):
+    r"""
+    Загружает данные региона из data/dump_cities.csv в формате, который
+    принимают аппроксиматоры.
+
+    :rtype: dict
+    """
+    data = dict()
+    with open(DUMP_PATH, encoding='utf-8') as f:
+        for row in csv.reader(f, delimiter=';'):
+            if row[1] == region:
+                data[len(data)] = {'date': row[0],
+                                   'died': int(row[5]),
+                                   'sick': int(row[6]),
+                                   'recovered': int(row[7])}
+    return data
+
+
+def last_days(data, days):
+    r"""Возвращает последние days дней выборки с нумерацией с нуля."""
+    keys = sorted(data)[-days:]
+    return {i: data[key] for i, key in enumerate(keys)}
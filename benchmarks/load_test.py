@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+r"""
+Нагрузочный тест запущенного сервиса смешанным трафиком: часть клиентов
+запрашивает прогнозы с разными датами обучения (каждый запрос обучает
+модели заново), остальные -- легкие страницы. Печатает перцентили
+времени ответа по маршрутам.
+
+Примеры::
+
+    python benchmarks/load_test.py http://localhost:8080
+    python benchmarks/load_test.py http://localhost:8080 \
+        --forecast-clients 8 --light-clients 4 --duration 60
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import common  # noqa: F401 (пути к covidlib)
+
+LIGHT_PATHS = ('/stats', '/metrics', '/')
+
+
+def default_models():
+    import covidlib
+
+    return {name: {'use': 1, 'parameters': {
+        key: value['default']
+        for key, value in getattr(covidlib, name)._parameters.items()}}
+        for name in ('NesterovConstantGamma', 'Nesterov')}
+
+
+def forecast_path(city, models, rng):
+    # разные даты обучения -- разные ключи кеша и реестра моделей
+    use_date_to = datetime(2020, 9, 1) + timedelta(days=rng.randrange(60))
+    date = {'use_date_from': '01.06.2020',
+            'use_date_to': use_date_to.strftime('%d.%m.%Y'),
+            'predict_date_to': (use_date_to + timedelta(days=30)).strftime(
+                '%d.%m.%Y')}
+    return '/json/{}?{}'.format(city, urllib.parse.urlencode(
+        {'models': json.dumps(models), 'date': json.dumps(date)}))
+
+
+def client(url, paths, route, stop, results, timeout):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url + next(paths),
+                                        timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = 'error'
+        results.append((route, status, time.perf_counter() - start))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(results, duration):
+    print('{:<10} {:>6} {:>7} {:>8} {:>8} {:>8} {:>8}'.format(
+        'route', 'count', 'errors', 'p50', 'p95', 'p99', 'max'))
+    for route in sorted({route for route, _, _ in results}):
+        times = [t for r, s, t in results if r == route and s == 200]
+        errors = sum(1 for r, s, _ in results if r == route and s != 200)
+        if not times:
+            print('{:<10} {:>6} {:>7}'.format(route, 0, errors))
+            continue
+        print('{:<10} {:>6} {:>7} {:>7.3f}s {:>7.3f}s {:>7.3f}s '
+              '{:>7.3f}s'.format(route, len(times), errors,
+                                 percentile(times, 0.5),
+                                 percentile(times, 0.95),
+                                 percentile(times, 0.99), max(times)))
+    print('{} requests in {:.0f}s'.format(len(results), duration))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url', help='address of the running service')
+    parser.add_argument('--city', default='RU-MOW')
+    parser.add_argument('--forecast-clients', type=int, default=4)
+    parser.add_argument('--light-clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    models = default_models()
+    stop = threading.Event()
+    results = []
+
+    def forecast_paths(seed):
+        rng = random.Random(seed)
+        while True:
+            yield forecast_path(args.city, models, rng)
+
+    def light_paths(seed):
+        rng = random.Random(seed)
+        while True:
+            yield rng.choice(LIGHT_PATHS)
+
+    threads = [threading.Thread(target=client, args=(
+        url, forecast_paths(args.seed + i), 'forecast', stop, results,
+        args.timeout)) for i in range(args.forecast_clients)]
+    threads += [threading.Thread(target=client, args=(
+        url, light_paths(args.seed + i), 'light', stop, results,
+        args.timeout)) for i in range(args.light_clients)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    report(results, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+r"""
+Запуск бенчмарков и сравнение с сохраненными результатами.
+
+Примеры::
+
+    python benchmarks/run.py approximators --save results.json
+    python benchmarks/run.py --compare benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+
+import bench_api
+import bench_approximators
+import bench_startup
+
+SUITES = {'approximators': bench_approximators.run,
+          'api': bench_api.run,
+          'startup': bench_startup.run}
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare(results, baseline, threshold):
+    r"""
+    Печатает отношение лучших времен к сохраненным результатам.
+
+    :return: список бенчмарков, которые замедлились больше чем в threshold
+        раз
+    :rtype: list
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            print('{:<76} {:>10.4f}s {:>10}'.format(
+                name, results[name]['min'], 'new'))
+            continue
+        ratio = results[name]['min'] / baseline[name]['min']
+        print('{:<76} {:>10.4f}s {:>9.2f}x'.format(
+            name, results[name]['min'], ratio))
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('suites', nargs='*',
+                        help='suites to run: {} (all by default)'.format(
+                            ', '.join(sorted(SUITES))))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='file to save results to')
+    parser.add_argument('--compare', help='file with baseline results')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='allowed slowdown relative to the baseline')
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite {}'.format(suite))
+    # набор api меняет рабочую директорию
+    save = os.path.abspath(args.save) if args.save else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    results = dict()
+    for suite in args.suites or sorted(SUITES):
+        results.update({'{}/{}'.format(suite, name): value for name, value
+                        in SUITES[suite](repeat=args.repeat).items()})
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump({'environment': environment(), 'results': results},
+                      f, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('regressions: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+    else:
+        for name in sorted(results):
+            print('{:<76} {:>10.4f}s'.format(name, results[name]['median']))
+
+
+if __name__ == '__main__':
+    main()
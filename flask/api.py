@@ -1,108 +1,477 @@
 # -*- coding: utf-8 -*-
-from copy import deepcopy
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import contextvars
+import copy
 from datetime import datetime, timedelta
 import inspect
 import json
 import sys
 import os
 import hashlib
+import importlib
 import logging
+import logging.handlers
 from functools import lru_cache
 from pathlib import Path
+import queue
 import re
+import threading
+import time as time_
+import uuid
 
-import boto3
-from botocore.exceptions import ClientError
-from bs4 import BeautifulSoup
-import pandas as pd
-import requests
+import numpy as np
 
 import covidlib
+import storage
 
 yandex_data_path = Path('data/dump_cities.csv').resolve()
 cities_codes_path = Path('data/mapping.json').resolve()
+# федеральные округа: {код: {'name': название, 'regions': коды регионов}}
+districts_path = Path('data/districts.json').resolve()
+# код агрегированного ряда по стране в целом
+country_code = 'RU'
+models_registry_path = Path(
+    os.environ.get('MODELS_REGISTRY_PATH', 'data/models')).resolve()
+models_n_jobs = int(os.environ.get('MODELS_N_JOBS', '1'))
+# сколько моделей может обучаться одновременно и сколько ждать в очереди
+fit_slots = int(os.environ.get('FIT_SLOTS', str(os.cpu_count() or 1)))
+fit_queue_size = int(os.environ.get('FIT_QUEUE_SIZE', '32'))
 
-class DynamoDBSingleton(object):
-    _dynamodb = None
+# хранилище данных: dynamodb либо mmap (локальные файлы в storage_path)
+storage_type = os.environ.get('STORAGE', 'dynamodb')
+storage_path = Path(os.environ.get('STORAGE_PATH', 'data/storage')).resolve()
+
+# сколько последних обновлений данных города хранит журнал версий
+versions_log_size = 64
+
+# сколько раз /series перечитывает данные города, которые записывают
+# во время чтения
+series_read_attempts = 3
+
+# наибольшее число траекторий интервального прогноза
+interval_max_samples = int(os.environ.get('INTERVAL_MAX_SAMPLES', '10000'))
+
+# как часто (в секундах) перечитываются номера версий данных регионов
+region_versions_ttl = float(os.environ.get('REGION_VERSIONS_TTL', '5'))
+
+# формат журнала: json (запись -- объект JSON в строке) либо text
+log_format = os.environ.get('LOG_FORMAT', 'json')
+# писать ли в журнал запись о каждом запросе (см. :func:`end_request`)
+log_requests = os.environ.get('LOG_REQUESTS', '1') == '1'
+
+profiling = covidlib.profiling
+profiling.enable(os.environ.get('PROFILING', '0') == '1')
+
+class StorageSingleton(object):
+    _storage = None
+
+    @staticmethod
+    def load():
+        if storage_type == 'mmap':
+            StorageSingleton._storage = storage.MmapStorage(storage_path)
+        else:
+            StorageSingleton._storage = storage.DynamoDBStorage()
+        return StorageSingleton._storage
+
+    @staticmethod
+    def get():
+        if StorageSingleton._storage is not None:
+            return StorageSingleton._storage
+        else:
+            return StorageSingleton.load()
+
+class AdmissionSingleton(object):
+    _queue = None
 
     @staticmethod
     def load():
-        DynamoDBSingleton._dynamodb = boto3.resource(
-            'dynamodb',
-            region_name="us-west-2",
-            endpoint_url="http://localhost:8000")
-        return DynamoDBSingleton._dynamodb
+        AdmissionSingleton._queue = covidlib.admission.AdmissionQueue(
+            fit_slots, fit_queue_size)
+        return AdmissionSingleton._queue
 
     @staticmethod
     def get():
-        if DynamoDBSingleton._dynamodb is not None:
-            return DynamoDBSingleton._dynamodb
+        if AdmissionSingleton._queue is not None:
+            return AdmissionSingleton._queue
         else:
-            return DynamoDBSingleton.load()
+            return AdmissionSingleton.load()
+
+class SeriesSnapshot(object):
+    r"""
+    Данные регионов в компактных массивах только для чтения вместе
+    с хешами данных регионов (см. :func:`storage.content_hash`).
+    Загружается в главном процессе gunicorn до fork (см. :func:`warmup`),
+    рабочие процессы читают общие страницы памяти (copy-on-write).
+    """
+    def __init__(self):
+        self._series = dict()
+
+    @staticmethod
+    def _freeze(array):
+        array.flags.writeable = False
+        return array
+
+    def add(self, city, data):
+        r"""
+        Добавляет данные города в формате :func:`get_city_statistic`.
+        """
+        keys = sorted(data)
+        fields = tuple(key for key in data[keys[0]] if key != 'date') \
+            if keys else tuple()
+        self._series[city] = (
+            self._freeze(np.array(keys, dtype=np.int32)),
+            self._freeze(np.array(
+                [datetime.strptime(data[key]['date'], '%d.%m.%Y').toordinal()
+                 for key in keys], dtype=np.int32)),
+            self._freeze(np.array(
+                [[data[key][field] for field in fields] for key in keys],
+                dtype=np.int32).reshape(len(keys), len(fields))),
+            fields,
+            storage.content_hash(data))
+
+    def __contains__(self, city):
+        return city in self._series
+
+    def hash(self, city):
+        r"""
+        Возвращает хеш данных города в снимке либо None, если города
+        в снимке нет.
+
+        :rtype: str
+        """
+        series = self._series.get(city)
+        return series[4] if series is not None else None
+
+    def cities(self):
+        return list(self._series)
+
+    def get(self, city):
+        r"""
+        Возвращает данные города в формате :func:`get_city_statistic`.
+
+        :rtype: dict
+        """
+        keys, dates, values, fields, _ = self._series[city]
+        data = dict()
+        for key, date, row in zip(keys.tolist(), dates.tolist(),
+                                  values.tolist()):
+            record = {'date': datetime.fromordinal(date).strftime('%d.%m.%Y')}
+            record.update(zip(fields, row))
+            data[key] = record
+        return data
+
+class SeriesSnapshotSingleton(object):
+    _snapshot = None
+
+    @staticmethod
+    def load():
+        snapshot = SeriesSnapshot()
+        storage_ = StorageSingleton.get()
+        for item in storage_.scan_cities():
+            snapshot.add(item['id'], storage_.get_data(item['id']))
+        SeriesSnapshotSingleton._snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def get():
+        r"""Возвращает загруженный снимок данных либо None."""
+        return SeriesSnapshotSingleton._snapshot
+
+    @staticmethod
+    def get_or_create():
+        r"""Возвращает снимок данных, создавая пустой при необходимости."""
+        if SeriesSnapshotSingleton._snapshot is None:
+            SeriesSnapshotSingleton._snapshot = SeriesSnapshot()
+        return SeriesSnapshotSingleton._snapshot
+
+class RegionVersions(object):
+    r"""
+    Номера версий и хеши данных регионов (см. :class:`storage.Storage`),
+    которые хранятся в процессе. Все номера перечитываются одним запросом
+    к базе, если с прошлого чтения прошло больше ttl секунд, а запись
+    данных в этом процессе обновляет номер города сразу (см.
+    :func:`store_data`). Пока одни потоки перечитывают номера, остальные
+    используют прежние.
+
+    :param ttl: как часто перечитываются номера версий
+    :type ttl: float
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._versions = dict()
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        r"""Перечитывает номера версий всех регионов."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        versions = {item['id']: (item['version'], item['hash'])
+                    for item in StorageSingleton.get().scan_versions()}
+        # номера версий только растут: чтение могло не увидеть запись,
+        # о которой процесс уже знает
+        for city, current in self._versions.items():
+            if city in versions and versions[city][0] < current[0]:
+                versions[city] = current
+        self._versions = versions
+        self._loaded = time_.monotonic()
+
+    def get(self, city):
+        r"""
+        Возвращает пару (номер версии, хеш данных) города либо None,
+        если города нет.
+
+        :rtype: tuple
+        """
+        if (self._loaded is None
+                or time_.monotonic() - self._loaded > self.ttl):
+            # первое чтение ждет, а устаревшие номера перечитывает
+            # только один поток
+            if self._lock.acquire(blocking=self._loaded is None):
+                try:
+                    if (self._loaded is None
+                            or time_.monotonic() - self._loaded > self.ttl):
+                        self._refresh()
+                finally:
+                    self._lock.release()
+        return self._versions.get(city)
+
+    def notify(self, city, version, hash_):
+        r"""Запоминает номер версии и хеш только что записанных данных."""
+        with self._lock:
+            current = self._versions.get(city)
+            if current is None or current[0] <= version:
+                self._versions = dict(self._versions,
+                                      **{city: (version, hash_)})
+
+class RegionVersionsSingleton(object):
+    _versions = None
+
+    @staticmethod
+    def load():
+        RegionVersionsSingleton._versions = RegionVersions(
+            region_versions_ttl)
+        return RegionVersionsSingleton._versions
+
+    @staticmethod
+    def get():
+        if RegionVersionsSingleton._versions is not None:
+            return RegionVersionsSingleton._versions
+        else:
+            return RegionVersionsSingleton.load()
+
+class ModelRegistrySingleton(object):
+    _registry = None
+
+    @staticmethod
+    def load():
+        ModelRegistrySingleton._registry = covidlib.ModelRegistry(
+            models_registry_path)
+        return ModelRegistrySingleton._registry
+
+    @staticmethod
+    def get():
+        if ModelRegistrySingleton._registry is not None:
+            return ModelRegistrySingleton._registry
+        else:
+            return ModelRegistrySingleton.load()
+
+class JsonFormatter(logging.Formatter):
+    r"""
+    Форматирует запись журнала как объект JSON в одну строку: time, level,
+    func, message, pid, thread и, если запись сделана во время запроса,
+    request_id и elapsed -- секунды с начала запроса (см.
+    :func:`begin_request`). Поля словаря extra={'fields': {...}}
+    добавляются в объект.
+    """
+    def format(self, record):
+        time = '{}.{:03d}'.format(
+            self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), int(record.msecs))
+        entry = {'time': time,
+                 'level': record.levelname,
+                 'func': record.funcName,
+                 'message': record.getMessage(),
+                 'pid': record.process,
+                 'thread': record.threadName}
+        for key in ('request_id', 'elapsed'):
+            if getattr(record, key, None) is not None:
+                entry[key] = getattr(record, key)
+        entry.update(getattr(record, 'fields', None) or dict())
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    r"""
+    QueueHandler, который оставляет текст исключения в exc_text записи,
+    а не дописывает его в message (стандартный prepare форматирует запись
+    целиком), чтобы :class:`JsonFormatter` записал его в поле exception.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        # traceback держит кадры стека, в очередь идет только его текст
+        record.exc_info = None
+        return record
+
+# идентификатор и время начала (time.perf_counter) текущего запроса
+_request_context = contextvars.ContextVar('request_context', default=None)
+
+# выполняется ли фоновая задача, см. :func:`background`
+_background = contextvars.ContextVar('background', default=False)
+
+def _add_request_context(record):
+    context = _request_context.get()
+    if context is not None:
+        record.request_id = context[0]
+        record.elapsed = round(time_.perf_counter() - context[1], 6)
+    return True
 
 class LoggerSinglton(object):
+    r"""
+    Журнал сервиса. Записи складываются в очередь (QueueHandler), а в файл
+    logs.log и в stdout их пишет отдельный поток (QueueListener), поэтому
+    запись журнала не задерживает потоки запросов. Формат записей задает
+    log_format.
+    """
     _init = False
+    _handler = None
+    _listener = None
 
     @staticmethod
     def init():
         if not LoggerSinglton._init:
             LoggerSinglton._init = True
-            logging.basicConfig(filename='logs.log',
-                    level=logging.INFO,
-                    format='%(asctime)s.%(msecs)03d %(levelname)s:%(funcName)s:%(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S')
-            logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+            LoggerSinglton._start()
+
+    @staticmethod
+    def _start():
+        file_handler = logging.FileHandler('logs.log')
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if log_format == 'json':
+            formatter = JsonFormatter()
+            stream_handler.setFormatter(formatter)
+        else:
+            formatter = logging.Formatter(
+                '%(asctime)s.%(msecs)03d %(levelname)s:%(funcName)s:'
+                '%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        file_handler.setFormatter(formatter)
+
+        queue_ = queue.SimpleQueue()
+        handler = _QueueHandler(queue_)
+        # контекст запроса берется в потоке, который пишет запись
+        handler.addFilter(_add_request_context)
+        listener = logging.handlers.QueueListener(
+            queue_, file_handler, stream_handler)
+        listener.start()
+
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(handler)
+        LoggerSinglton._handler = handler
+        LoggerSinglton._listener = listener
+
+    @staticmethod
+    def stop():
+        r"""Дописывает записи из очереди и останавливает поток записи."""
+        if LoggerSinglton._listener is not None:
+            logging.getLogger().removeHandler(LoggerSinglton._handler)
+            LoggerSinglton._listener.stop()
+            LoggerSinglton._listener = None
+            LoggerSinglton._init = False
+
+    @staticmethod
+    def after_fork():
+        r"""
+        Запускает поток записи журнала в процессе после fork (поток
+        главного процесса в дочерний не переходит).
+        """
+        if LoggerSinglton._listener is not None:
+            logging.getLogger().removeHandler(LoggerSinglton._handler)
+            LoggerSinglton._listener = None
+            LoggerSinglton._start()
+
+# при выходе записи из очереди дописываются в журнал
+atexit.register(LoggerSinglton.stop)
+
+def begin_request(request_id=None):
+    r"""
+    Начинает запрос в текущем потоке (задаче asyncio): записи журнала
+    получают идентификатор запроса и время с его начала.
+
+    :param request_id: идентификатор запроса (например, из заголовка
+        X-Request-ID); если не задан, создается новый
+    :type request_id: str
+
+    :return: идентификатор запроса
+    :rtype: str
+    """
+    if not request_id or len(request_id) > 128:
+        request_id = uuid.uuid4().hex
+    _request_context.set((request_id, time_.perf_counter()))
+    return request_id
+
+def end_request(**fields):
+    r"""
+    Заканчивает запрос текущего потока и, если log_requests, пишет
+    в журнал запись request с длительностью запроса duration (в секундах,
+    как в метрике covid_request_seconds) и полями fields.
+
+    :return: длительность запроса в секундах либо None, если запрос
+        не начинался
+    :rtype: float
+    """
+    context = _request_context.get()
+    if context is None:
+        return None
+    duration = time_.perf_counter() - context[1]
+    if log_requests:
+        logging.info('request', extra={'fields': dict(
+            fields, duration=round(duration, 6))})
+    _request_context.set(None)
+    return duration
+
+
+@contextmanager
+def background():
+    r"""
+    Контекстный менеджер для фоновых задач (например, выгрузки прогнозов,
+    см. :mod:`export`): модели, которые обучаются в текущем потоке внутри
+    него, ждут в очереди допуска после моделей запросов пользователей
+    и первыми вытесняются из заполненной очереди.
+    """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
 
 def init_base():
     LoggerSinglton.init()
     logging.info('init database')
 
-    dynamodb = DynamoDBSingleton.get()
-    try:
-        cities = dynamodb.create_table(
-            TableName='cities',
-            KeySchema=[
-                {
-                    'AttributeName': 'id',
-                    'KeyType': 'HASH'
-                },
-            ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'id',
-                    'AttributeType': 'S'
-                },
-            ],
-            ProvisionedThroughput={
-                'ReadCapacityUnits': 5,
-                'WriteCapacityUnits': 5
-            }
-        )
-        meta = dynamodb.create_table(
-            TableName='meta',
-            KeySchema=[
-                {
-                    'AttributeName': 'id',
-                    'KeyType': 'HASH'
-                },
-            ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'id',
-                    'AttributeType': 'S'
-                },
-            ],
-            ProvisionedThroughput={
-                'ReadCapacityUnits': 5,
-                'WriteCapacityUnits': 5
-            }
-        )
-    except Exception:
+    storage_ = StorageSingleton.get()
+    if not storage_.create():
         logging.info('load database from checkpoint')
-        cities = dynamodb.Table('cities')
-        meta = dynamodb.Table('meta')
+        create_aggregates(storage_.get_meta()['date_'])
         return
 
+    import pandas as pd
+
+    # номера версий новой базы снова начинаются с 1
+    ModelRegistrySingleton.get().clear()
+
     yandex_data = pd.read_csv(yandex_data_path, delimiter=';')
     with open(cities_codes_path) as f:
         cities_codes = json.load(f)
@@ -111,6 +480,7 @@ def init_base():
     for key in cities_codes:
         inverse_index[cities_codes[key]['yandex_name']] = key
 
+    datas = dict()
     for city in yandex_data['region'].unique():
         if city in inverse_index:
             data_for_city = yandex_data[
@@ -122,45 +492,49 @@ def init_base():
                                       'sick': row[6],
                                       'recovered': row[7]}
             last_date = data[data.__len__() - 1]['date']
-            cities.put_item(
-                Item={'id': inverse_index[city],
-                      'name': cities_codes[inverse_index[city]]['name'],
-                      'from_': data[0]['date'],
-                      'to_': last_date,
-                      'data_': json.dumps(data)})
-
-    meta.put_item(
-        Item={'id': 'update',
-              'date_': datetime.strptime(
-                last_date, 
-                '%d.%m.%Y').strftime('%S.%M.%H.%d.%m.%Y'),
-              'last_try_': datetime.strptime(
-                last_date, 
-                '%d.%m.%Y').strftime('%S.%M.%H.%d.%m.%Y')})
+            datas[inverse_index[city]] = data
+
+    version = datetime.strptime(
+        last_date, '%d.%m.%Y').strftime('%S.%M.%H.%d.%m.%Y')
+    for key in datas:
+        storage_.put_city(key, cities_codes[key]['name'], datas[key],
+                          log_version([], version, 0, 1,
+                                      storage.content_hash(datas[key])))
+    create_aggregates(version, datas)
+
+    storage_.update_meta(date_=version, last_try_=version)
 
     logging.info('init new database')
 
 def update_by_stopcoronavirus():
+    import requests
+
     LoggerSinglton.init()
     logging.info('start parse stopcoronavirus')
-    dynamodb = DynamoDBSingleton.get()
-    cities_table = dynamodb.Table('cities')
-    meta_table = dynamodb.Table('meta')
+    storage_ = StorageSingleton.get()
 
     url = 'https://стопкоронавирус.рф/covid_data.json?do=region_stats&code={}'
 
     cities = get_cities()
-    
+    aggregates = get_aggregates()
+    # новые записи регионов, которые прибавляются к агрегированным рядам
+    appended = dict()
+    # версия последней записи данных региона
+    written = None
+
     for key in cities:
+        if key in aggregates:
+            continue
         logging.info('load info for {}'.format(key))
 
-        city_item = cities_table.get_item(Key={'id': key})
-        if 'Item' not in city_item:
+        city_item = storage_.get_city(key)
+        if city_item is None:
             logging.info('bad city {}'.foramat(key))
             continue
 
-        to_ = datetime.strptime(city_item['Item']['to_'], '%d.%m.%Y')
-        data_ = json.loads(city_item['Item']['data_'])
+        to_ = datetime.strptime(city_item['to_'], '%d.%m.%Y')
+        data_ = storage_.get_data(key)
+        changed_from = len(data_)
 
         if to_.date() >= datetime.today().date():
             logging.info('nothing to update for {}'.format(key))
@@ -192,30 +566,213 @@ def update_by_stopcoronavirus():
                 to_ = item['date']
                 flag = True
         
-        if flag:
+        version = datetime.today().strftime('%S.%M.%H.%d.%m.%Y')
+        if flag and store_data(city_item, data_, version, changed_from):
             logging.info('update info for {}'.format(key))
-            cities_table.update_item(
-                Key={'id': key},
-                UpdateExpression="set to_=:date, data_=:data",
-                ExpressionAttributeValues={
-                    ':date': to_.strftime('%d.%m.%Y'),
-                    ':data': json.dumps(data_)},
-                ReturnValues="UPDATED_NEW")
-
-            meta_table.update_item(
-                Key={'id': 'update'},
-                UpdateExpression="set date_=:date",
-                ExpressionAttributeValues={
-                    ':date': datetime.today().strftime('%S.%M.%H.%d.%m.%Y')
-                },
-                ReturnValues="UPDATED_NEW"
-            )
+            storage_.update_meta(date_=version)
+            appended[key] = [data_[i] for i in range(changed_from,
+                                                     len(data_))]
+            written = version
         else:
             logging.info('nothing to update for {}'.format(key))
 
+    if appended:
+        # версия агрегированных рядов новее версий регионов: клиент,
+        # получивший /series после записи региона, увидит и их изменения
+        version = max(datetime.today(), parse_version(written)
+                      + timedelta(seconds=1)).strftime('%S.%M.%H.%d.%m.%Y')
+        if update_aggregates(appended, version):
+            storage_.update_meta(date_=version)
     logging.info('end parse stopcoronavirus')
     return {}
 
+def store_data(city_item, data, version, changed_from):
+    r"""
+    Записывает новые данные города, если их содержимое изменилось
+    (сравниваются хеши, см. :func:`storage.content_hash`). Обученные
+    модели сбрасываются только у этого города.
+
+    :param city_item: описание города из хранилища
+    :type city_item: dict
+
+    :param data: данные города в формате :func:`get_city_statistic`
+    :type data: dict
+
+    :param version: версия данных, которая записывается в журнал версий
+    :type version: str
+
+    :param changed_from: номер первой измененной записи
+    :type changed_from: int
+
+    :return: False, если данные не изменились и не записывались
+    :rtype: bool
+    """
+    hash_ = storage.content_hash(data)
+    if hash_ == city_item['hash']:
+        return False
+
+    ModelRegistrySingleton.get().drop(city_item['id'])
+    # данные городов записывает только обновление базы, поэтому номер
+    # новой версии известен до записи
+    number = StorageSingleton.get().update_data(
+        city_item['id'], data,
+        log_version(city_item['versions'], version, changed_from,
+                    city_item['version'] + 1, hash_))
+    RegionVersionsSingleton.get().notify(city_item['id'], number, hash_)
+    return True
+
+def get_aggregates():
+    r"""
+    Возвращает агрегированные ряды: страну в целом (country_code, все
+    регионы из data/mapping.json) и федеральные округа из
+    data/districts.json. Данные агрегированного ряда -- суммы данных
+    входящих в него регионов по дням; ряд хранится в базе как отдельный
+    город.
+
+    :return: словарь {код ряда: {'name': название,
+                                 'regions': список кодов регионов}}
+    :rtype: dict
+    """
+    with open(cities_codes_path) as f:
+        cities_codes = json.load(f)
+    with open(districts_path, encoding='utf-8') as f:
+        districts = json.load(f)
+
+    aggregates = {country_code: {'name': 'Россия',
+                                 'regions': sorted(cities_codes)}}
+    aggregates.update(districts)
+    return aggregates
+
+def add_records(data, records):
+    r"""
+    Прибавляет записи records к данным агрегированного ряда data (data
+    изменяется на месте): значения за дни, которые уже есть в data,
+    складываются, новые дни добавляются с сохранением порядка по датам.
+
+    :param data: данные ряда в формате :func:`get_city_statistic`
+    :type data: dict
+
+    :param records: записи в формате :func:`get_city_statistic`
+    :type records: list
+
+    :return: номер первой измененной записи data либо None, если
+        records пуст
+    :rtype: int
+    """
+    fields = list(get_data_field())
+    index = {data[key]['date']: key for key in data}
+    last = (datetime.strptime(data[len(data) - 1]['date'], '%d.%m.%Y')
+            if data else None)
+
+    changed = set()
+    ordered = True
+    for record in records:
+        key = index.get(record['date'])
+        if key is None:
+            date = datetime.strptime(record['date'], '%d.%m.%Y')
+            ordered = ordered and (last is None or date > last)
+            last = date if last is None else max(last, date)
+            key = index[record['date']] = len(data)
+            data[key] = dict({'date': record['date']},
+                             **{field: 0 for field in fields})
+        for field in fields:
+            data[key][field] += int(record[field])
+        changed.add(record['date'])
+
+    if not ordered:
+        records = sorted(data.values(), key=lambda record: datetime.strptime(
+            record['date'], '%d.%m.%Y'))
+        data.clear()
+        data.update(enumerate(records))
+    return min((key for key in data if data[key]['date'] in changed),
+               default=None)
+
+def aggregate_data(datas):
+    r"""
+    Складывает данные регионов по дням.
+
+    :param datas: данные регионов в формате :func:`get_city_statistic`
+    :type datas: list
+
+    :return: данные в формате :func:`get_city_statistic` за все дни,
+        за которые есть данные хотя бы одного региона
+    :rtype: dict
+    """
+    data = dict()
+    for region in datas:
+        add_records(data, [region[key] for key in sorted(region)])
+    return data
+
+def create_aggregates(version, datas=None):
+    r"""
+    Записывает в базу агрегированные ряды (см. :func:`get_aggregates`),
+    которых в ней еще нет.
+
+    :param version: версия данных, которая записывается в журнал версий
+    :type version: str
+
+    :param datas: уже прочитанные данные регионов {регион: данные};
+        если не заданы, данные регионов читаются из базы
+    :type datas: dict
+
+    :return: коды записанных рядов
+    :rtype: list
+    """
+    storage_ = StorageSingleton.get()
+    created = []
+    for code, aggregate in get_aggregates().items():
+        if storage_.get_city(code) is not None:
+            continue
+        if datas is None:
+            members = storage_.get_data_many(aggregate['regions'])
+        else:
+            members = {region: datas[region] for region in aggregate['regions']
+                       if region in datas}
+        data = aggregate_data([members[region] for region in members
+                               if members[region]])
+        if data:
+            storage_.put_city(code, aggregate['name'], data,
+                              log_version([], version, 0, 1,
+                                          storage.content_hash(data)))
+            created.append(code)
+            logging.info('create aggregate {}'.format(code))
+    return created
+
+def update_aggregates(appended, version):
+    r"""
+    Прибавляет новые записи регионов к агрегированным рядам, в которые
+    входят эти регионы. Читаются и записываются только данные этих рядов,
+    данные остальных регионов не перечитываются.
+
+    :param appended: словарь {регион: новые записи в формате
+        :func:`get_city_statistic`}
+    :type appended: dict
+
+    :param version: версия данных, которая записывается в журнал версий
+    :type version: str
+
+    :return: коды записанных рядов
+    :rtype: list
+    """
+    storage_ = StorageSingleton.get()
+    # ряды, которых еще не было в базе, строятся уже по новым данным
+    created = create_aggregates(version)
+    updated = list(created)
+    for code, aggregate in get_aggregates().items():
+        regions = [region for region in aggregate['regions']
+                   if appended.get(region)]
+        if code in created or not regions:
+            continue
+
+        city_item = storage_.get_city(code)
+        data = storage_.get_data(code)
+        changed_from = min(add_records(data, appended[region])
+                           for region in regions)
+        if store_data(city_item, data, version, changed_from):
+            logging.info('update aggregate {}'.format(code))
+            updated.append(code)
+    return updated
+
 def update_data(type_='stopcoronavirus'):
     r"""
     Обновляет данные в базе данных на основе заданого сайта. 
@@ -227,11 +784,9 @@ def update_data(type_='stopcoronavirus'):
     LoggerSinglton.init()
     logging.info('start of update')
 
-    dynamodb = DynamoDBSingleton.get()
-    meta_table = dynamodb.Table('meta')
+    storage_ = StorageSingleton.get()
 
-    last_try_ = meta_table.get_item(Key={'id': 'update'})
-    time = last_try_['Item']['last_try_']
+    time = storage_.get_meta()['last_try_']
     time = datetime.strptime(time, '%S.%M.%H.%d.%m.%Y')
     current_time = datetime.today()
 
@@ -240,14 +795,8 @@ def update_data(type_='stopcoronavirus'):
         logging.info('previous try = {}, now = {}'.format(
             time.strftime('%S:%M:%H/%d.%m.%Y'), 
             current_time.strftime('%S:%M:%H/%d.%m.%Y')))
-        meta_table.update_item(
-            Key={'id': 'update'},
-            UpdateExpression="set last_try_=:date",
-            ExpressionAttributeValues={
-                ':date': current_time.strftime('%S.%M.%H.%d.%m.%Y')
-            },
-            ReturnValues="UPDATED_NEW"
-        )
+        storage_.update_meta(
+            last_try_=current_time.strftime('%S.%M.%H.%d.%m.%Y'))
         if type_ == 'stopcoronavirus':
             ret = update_by_stopcoronavirus()
     else:
@@ -257,6 +806,100 @@ def update_data(type_='stopcoronavirus'):
     logging.info('end of update')
     return ret
 
+def parse_version(version):
+    r"""
+    Переводит версию данных (время обновления базы) в datetime, чтобы
+    версии можно было сравнивать.
+
+    :type version: str
+    :rtype: datetime
+    """
+    return datetime.strptime(version, '%S.%M.%H.%d.%m.%Y')
+
+def log_version(versions, version, changed_from, number, hash_):
+    r"""
+    Добавляет запись в журнал версий данных города (см.
+    :class:`storage.Storage`); журнал хранит versions_log_size последних
+    записей.
+
+    :param versions: журнал версий
+    :type versions: list
+
+    :param version: версия данных (время обновления базы)
+    :type version: str
+
+    :param changed_from: номер первой записи, измененной в этой версии
+    :type changed_from: int
+
+    :param number: номер версии данных города после записи
+    :type number: int
+
+    :param hash_: хеш записанных данных (см. :func:`storage.content_hash`)
+    :type hash_: str
+
+    :return: новый журнал версий
+    :rtype: list
+    """
+    return (list(versions)
+            + [[version, changed_from, number, hash_]])[-versions_log_size:]
+
+def get_series(city, since=None):
+    r"""
+    Возвращает записи данных города, измененные после версии данных since
+    (см. :func:`get_region_version`). Если since не задана либо ее нет
+    в журнале версий города, возвращаются все записи.
+
+    Данные и их версия читаются согласованно: версия читается после
+    данных и принимается, только если хеш прочитанных данных совпадает
+    с ее хешем, иначе (данные записали между чтениями) данные читаются
+    заново. Поэтому клиент не получит версию новее своих данных.
+
+    :param city: город
+    :type city: str
+
+    :param since: версия данных, которая уже есть у клиента
+    :type since: str
+
+    :return: словарь {'version': версия возвращенных данных (None, если
+        города нет), 'full': True, если возвращены все записи, 'data':
+        записи в формате :func:`get_city_statistic`}. Клиент заменяет свои
+        записи записями с теми же номерами.
+    :rtype: dict
+    """
+    if since is not None:
+        number, _, hash_ = since.partition('.')
+        since = (int(number), hash_)
+
+    storage_ = StorageSingleton.get()
+    for _ in range(series_read_attempts):
+        data = get_city_statistic(city, get_region_version(city))
+        city_item = storage_.get_city(city)
+        if city_item is None:
+            return {'version': None, 'full': True, 'data': dict()}
+        hash_ = storage.content_hash(data)
+        # у городов, записанных до появления хешей, хеша нет
+        if city_item['hash'] in (None, hash_):
+            break
+    else:
+        raise RuntimeError('data of {} is being rewritten'.format(city))
+
+    version = '{}.{}'.format(city_item['version'], hash_)
+    # записи журнала, в которых есть номер версии и хеш данных
+    versions = [item for item in city_item['versions'] if len(item) == 4]
+    changed_from = 0
+    full = True
+    if since is not None:
+        if since == (city_item['version'], hash_):
+            return {'version': version, 'full': False, 'data': dict()}
+        if any(tuple(item[2:]) == since for item in versions):
+            full = False
+            changed_from = min(item[1] for item in versions
+                               if item[2] > since[0])
+
+    return {'version': version, 'full': full,
+            'data': {key: data[key] for key in sorted(data)
+                     if key >= changed_from}}
+
 def prune_data(data, use_date_from, use_date_to):
     r"""
 
@@ -272,7 +915,113 @@ def prune_data(data, use_date_from, use_date_to):
 
     return new_data
 
-def approximate(city, models, date):
+def get_region_version(city):
+    r"""
+    Возвращает версию данных города -- номер версии и хеш данных из
+    :class:`RegionVersions`, поэтому обычно база не читается. Версия
+    входит в ключи кешей прогнозов, реестра моделей и ETag, поэтому
+    обновление данных одного города не сбрасывает прогнозы остальных.
+    Номер версии начинается заново после пересоздания базы либо смены
+    хранилища, а хеш различает данные с одинаковым номером.
+
+    :param city: город
+    :type city: str
+
+    :return: версия данных либо None, если города нет
+    :rtype: str
+    """
+    current = RegionVersionsSingleton.get().get(city)
+    if current is None:
+        return None
+    number, hash_ = current
+    if hash_ is None:
+        # город записан до появления хешей
+        hash_ = storage.content_hash(StorageSingleton.get().get_data(city))
+    return '{}.{}'.format(number, hash_)
+
+def get_data_version():
+    r"""
+    Возвращает время последнего обновления базы. Оно записывается
+    в журналы версий городов (см. :func:`log_version`).
+
+    :rtype: str
+    """
+    with profiling.timer('meta_read'):
+        return StorageSingleton.get().get_meta()['date_']
+
+def canonical_request(city, models, date, fields=None, interval=None):
+    r"""
+    Приводит параметры запроса прогноза к каноническому виду: одинаковые
+    по смыслу запросы дают одинаковые аргументы (и попадают в один ключ
+    кеша).
+
+    :param city: город для аппроксимации
+    :type city: str
+
+    :param models: словарь моделей с параметрами в формате JSON
+    :type models: json
+
+    :param date: набор дат, которые нужны для построения и инферена модели,
+        а также (необязательно) plot_date_from и plot_date_to -- окно,
+        которое нужно вернуть
+    :type date: json
+
+    :param fields: список полей в формате JSON, которые нужно вернуть
+        (по умолчанию все поля)
+    :type fields: json
+
+    :param interval: параметры интервального прогноза в формате JSON:
+        quantiles -- уровни квантилей, samples -- количество траекторий
+        (по умолчанию интервалы не считаются)
+    :type interval: json
+
+    :return: кортеж (city, models, date, fields, interval)
+    :rtype: tuple
+    """
+    models = json.dumps(json.loads(models), sort_keys=True)
+
+    # в ключ кеша попадают только даты, влияющие на ответ
+    date = json.loads(date)
+    date = json.dumps({key: date[key] for key in (
+        'use_date_from', 'use_date_to', 'predict_date_to',
+        'plot_date_from', 'plot_date_to') if date.get(key)}, sort_keys=True)
+
+    if fields is None:
+        fields = list(get_data_field())
+    else:
+        fields = [key for key in get_data_field() if key in json.loads(fields)]
+
+    if interval is not None:
+        interval = json.loads(interval)
+        interval = json.dumps({
+            'quantiles': sorted({min(max(float(level), 0.0), 1.0) for level
+                                 in interval.get('quantiles',
+                                                 [0.05, 0.5, 0.95])}),
+            'samples': min(max(int(interval.get('samples', 1000)), 1),
+                           interval_max_samples)}, sort_keys=True)
+    return city, models, date, json.dumps(fields), interval
+
+def request_etag(request, time):
+    r"""
+    Возвращает ETag ответа на запрос прогноза.
+
+    :param request: запрос в виде результата :func:`canonical_request`
+    :type request: tuple
+
+    :param time: версия данных
+    :type time: str
+
+    :rtype: str
+    """
+    return hashlib.sha1(
+        json.dumps([list(request), time]).encode('utf-8')).hexdigest()
+
+
+class UnknownRegion(LookupError):
+    r"""Города нет в базе."""
+
+
+def approximate(city, models, date, fields=None, interval=None, time=None):
     r"""
     :param city: город для аппроксимации
     :type city: str
@@ -281,18 +1030,129 @@ def approximate(city, models, date):
         json чтобы можно было в кеш записать все
     :type models: json
 
-    :param date: набор дат, которые нужны для построения и инферена модели
+    :param date: набор дат, которые нужны для построения и инферена модели,
+        а также (необязательно) plot_date_from и plot_date_to -- окно,
+        которое нужно вернуть
     :type date: json
+
+    :param fields: список полей в формате JSON, которые нужно вернуть
+        (по умолчанию все поля)
+    :type fields: json
+
+    :param interval: параметры интервального прогноза в формате JSON,
+        см. :func:`canonical_request`
+    :type interval: json
+
+    :param time: версия данных города (по умолчанию читается из базы),
+        см. :func:`get_region_version`
+    :type time: str
+    """
+    if time is None:
+        time = get_region_version(city)
+        if time is None:
+            raise UnknownRegion(city)
+
+    city, models, date, fields, interval = canonical_request(
+        city, models, date, fields, interval)
+    return _approximate(city, models, date, time, fields, interval)
+
+def approximate_many(requests):
+    r"""
+    Считает прогнозы для нескольких запросов. Одинаковые запросы считаются
+    один раз, данные всех городов читаются из базы одним запросом (см.
+    :func:`prefetch_statistics`), а разные запросы считаются параллельно
+    в fit_slots потоках; обучение моделей по-прежнему ограничивается
+    очередью допуска. Признак отмены текущего потока действует на все
+    запросы.
+
+    :param requests: запросы в виде результатов :func:`canonical_request`
+    :type requests: list
+
+    :return: генератор пар (номера запросов в requests, прогноз либо
+        исключение, которым завершился его расчет, например
+        :class:`covidlib.admission.Overloaded` либо
+        :class:`UnknownRegion`) в порядке готовности
+        прогнозов; отмена (:class:`covidlib.cancellation.Cancelled`)
+        прерывает весь генератор
+    :rtype: generator
     """
-    dynamodb = DynamoDBSingleton.get()
-    meta_table = dynamodb.Table('meta')
-    update = meta_table.get_item(Key={'id': 'update'})
-    time = update['Item']['date_']
-    return _approximate(city, models, date, time)
+    unique = dict()
+    for index, request in enumerate(requests):
+        unique.setdefault(tuple(request), []).append(index)
+    versions = prefetch_statistics([request[0] for request in unique])
+
+    token = covidlib.cancellation.current()
+
+    def run(request):
+        city, models, date, fields, interval = request
+        if versions[city] is None:
+            return UnknownRegion(city)
+        with covidlib.cancellation.scope(token):
+            try:
+                return _approximate(city, models, date, versions[city],
+                                    fields, interval)
+            except covidlib.admission.Overloaded as e:
+                return e
+            except covidlib.cancellation.Cancelled:
+                raise
+            except Exception as e:
+                # ошибка одного задания не прерывает остальные
+                logging.exception('batch job for {} failed'.format(city))
+                return e
+
+    pool = ThreadPoolExecutor(min(fit_slots, len(unique)) or 1,
+                              thread_name_prefix='batch')
+    futures = dict()
+    try:
+        for request, indexes in unique.items():
+            futures[pool.submit(run, request)] = indexes
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # если ответ больше не нужен, еще не начатые прогнозы не считаются
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+def _project(records, fields, date_from=None, date_to=None):
+    r"""
+    Оставляет в записях только дату и поля fields, а также только записи
+    с датами от date_from до date_to включительно.
+
+    :param records: записи вида {'date': ..., поле: значение}
+    :type records: iterable
+
+    :return: словарь вида {номер записи: запись}
+    :rtype: dict
+    """
+    ret = dict()
+    for record in records:
+        if date_from is not None or date_to is not None:
+            cur_date = datetime.strptime(record['date'], '%d.%m.%Y')
+            if date_from is not None and cur_date < date_from:
+                continue
+            if date_to is not None and cur_date > date_to:
+                continue
+        projected = {'date': record['date']}
+        for field in fields:
+            projected[field] = record[field]
+        ret[ret.__len__()] = projected
+    return ret
 
 @lru_cache(maxsize=10 ** 8)
-def _approximate(city, models, date, time):
+def _approximate(city, models, date, time, fields, interval=None):
     r"""
+    Кеширует результаты :func:`forecast_region`.
+    """
+    return forecast_region(city, models, date, time, fields, interval)
+
+
+def forecast_region(city, models, date, time, fields, interval=None):
+    r"""
+    Считает прогнозы моделей models для города city без кеша прогнозов
+    (обученные модели берутся из кеша и реестра, см. :func:`_fit`).
+    Параметры -- в виде результата :func:`canonical_request`.
+
     :param city: город для аппроксимации
     :type city: str
 
@@ -303,63 +1163,305 @@ def _approximate(city, models, date, time):
     :param date: набор дат, которые нужны для построения и инферена модели
     :type date: json
 
-    :param time: время последнего обновления базы 
-        (данная фича позволяет не включить кеш, если база была обновлена)
+    :param time: версия данных города, см. :func:`get_region_version`
+        (кеш сбрасывается только при изменении данных этого города)
     :type time: str
+
+    :param fields: список полей, которые нужно вернуть, в формате JSON
+    :type fields: json
+
+    :param interval: параметры интервального прогноза в формате JSON
+        либо None. Квантили прогноза добавляются в записи моделей
+        в поле intervals: {поле: {уровень квантиля: значение}}.
+    :type interval: json
     """
     models = json.loads(models)
     date = json.loads(date)
+    fields = json.loads(fields)
     worked_models = get_models()
 
-    data = get_city_statistic(city)
+    plot_date_from = date.get('plot_date_from')
+    if plot_date_from is not None:
+        plot_date_from = datetime.strptime(plot_date_from, '%d.%m.%Y')
+    plot_date_to = date.get('plot_date_to')
+    if plot_date_to is not None:
+        plot_date_to = datetime.strptime(plot_date_to, '%d.%m.%Y')
+
+    # дальше конца окна графика прогноз не нужен
+    predict_date_to = datetime.strptime(date['predict_date_to'], '%d.%m.%Y')
+    if plot_date_to is not None:
+        predict_date_to = min(predict_date_to, plot_date_to)
+
+    data = get_city_statistic(city, time)
 
     datas = dict()
-    datas['real'] = deepcopy(data)
+    with profiling.timer('projection'):
+        datas['real'] = _project([data[key] for key in sorted(data)],
+                                 fields, plot_date_from, plot_date_to)
 
+    forecast_date_from = (datetime.strptime(date['use_date_to'], '%d.%m.%Y')
+                          + timedelta(days=1))
     for mod in models:
-        datas[mod] = deepcopy(data)
-        datas[mod] = prune_data(
-            datas[mod], date['use_date_from'], date['use_date_to'])
+        # запрос мог быть отменен, пока считались предыдущие модели
+        covidlib.cancellation.check()
+        if not fields or predict_date_to < forecast_date_from:
+            datas[mod] = dict()
+            continue
 
         model = worked_models[mod]['model'](**models[mod]['parameters'])
-        model.fit(datas[mod])
+        forecast = _fit(city, mod,
+                        json.dumps(model.get_parameters(), sort_keys=True),
+                        date['use_date_from'], date['use_date_to'], time)
+
+        preds = forecast.predict_to(predict_date_to.strftime('%d.%m.%Y'),
+                                    fields)
+        with profiling.timer('projection'):
+            datas[mod] = _project(preds, fields, plot_date_from)
+
+        if interval is not None:
+            try:
+                bands = forecast.interval_to(
+                    predict_date_to.strftime('%d.%m.%Y'), fields,
+                    **json.loads(interval))
+            except NotImplementedError:
+                continue
+            bands = {band['date']: band for band in bands}
+            for record in datas[mod].values():
+                band = bands[record['date']]
+                record['intervals'] = {field: band[field]
+                                       for field in fields}
 
-        datas[mod] = dict()
-        preds = model.predict_between(
-            (datetime.strptime(date['use_date_to'], '%d.%m.%Y')
-                + timedelta(days=1)).strftime('%d.%m.%Y'),
-            date['predict_date_to'])
+    return datas
 
-        for pred in preds:
-            datas[mod][datas[mod].__len__()] = pred
+class Forecast(object):
+    r"""
+    Обученная модель вместе с уже посчитанным по ней прогнозом.
+    Прогноз только дописывается: при увеличении горизонта модель
+    предсказывает лишь недостающие дни, а при запросе новых полей --
+    только эти поля.
+    """
+    def __init__(self, model, date_from):
+        self.model = model
+        self.date_from = datetime.strptime(date_from, '%d.%m.%Y')
+        self.preds = []
+        self.fields = set()
+        self._lock = threading.Lock()
+
+    def predict_to(self, date_to, fields):
+        r"""
+        Возвращает прогноз с первого дня после окна обучения до date_to
+        включительно. В записях есть как минимум поля fields.
+
+        :param date_to: строка формата "day.month.year"
+        :type date_to: str
+
+        :param fields: поля, которые нужно предсказать
+        :type fields: list
+
+        :rtype: list
+        """
+        date_to = datetime.strptime(date_to, '%d.%m.%Y')
+        with self._lock:
+            missing = [field for field in fields if field not in self.fields]
+            if missing and self.preds:
+                preds = self.model.predict_between(
+                    self.date_from.strftime('%d.%m.%Y'),
+                    self.preds[-1]['date'], missing)
+                for pred, new in zip(self.preds, preds):
+                    pred.update(new)
+            self.fields.update(missing)
+
+            next_date = self.date_from + timedelta(days=len(self.preds))
+            if next_date <= date_to:
+                self.preds.extend(self.model.predict_between(
+                    next_date.strftime('%d.%m.%Y'),
+                    date_to.strftime('%d.%m.%Y'), sorted(self.fields)))
+            return self.preds[:max((date_to - self.date_from).days + 1, 0)]
+
+    def interval_to(self, date_to, fields, quantiles, samples):
+        r"""
+        Возвращает интервальный прогноз с первого дня после окна обучения
+        до date_to включительно, см.
+        :meth:`covidlib.approximator.Approximator.predict_interval`.
+
+        :rtype: list
+        """
+        date_to = datetime.strptime(date_to, '%d.%m.%Y')
+        if date_to < self.date_from:
+            return []
+        with self._lock:
+            return self.model.predict_interval(
+                self.date_from.strftime('%d.%m.%Y'),
+                date_to.strftime('%d.%m.%Y'), fields,
+                quantiles=quantiles, samples=samples)
+
+@lru_cache(maxsize=1024)
+def _fit(city, model, parameters, use_date_from, use_date_to, time):
+    r"""
+    Возвращает обученную модель в виде :class:`Forecast`. Модель берется
+    из хранилища обученных моделей либо обучается заново. Горизонт
+    прогноза в ключ кеша не входит.
 
-    return datas
+    :param city: город для аппроксимации
+    :type city: str
 
+    :param model: название модели
+    :type model: str
 
-def get_dates(city):
-    dynamodb = DynamoDBSingleton.get()
-    table = dynamodb.Table('cities')
-    response = table.get_item(Key={'id': city})
+    :param parameters: нормализованные параметры модели в формате JSON
+    :type parameters: json
 
-    if 'Item' not in response:
-        return '01.01.2020', '01.10.2020'
+    :param use_date_from: начало окна обучения
+    :type use_date_from: str
 
-    return response['Item']['from_'], response['Item']['to_']
+    :param use_date_to: конец окна обучения
+    :type use_date_to: str
 
-def scan_table(table):
-    response = table.scan()
-    yield from response['Items']
+    :param time: время последнего обновления базы
+    :type time: str
+
+    :rtype: Forecast
+    """
+    registry = ModelRegistrySingleton.get()
+    parameters = json.loads(parameters)
+    key = registry.make_key(
+        city, model, parameters, use_date_from, use_date_to, time)
+
+    with profiling.timer('registry_get'):
+        approximator = registry.get(key)
+    if approximator is None:
+        model_class = get_models()[model]['model']
+        # модели с параметрами по умолчанию обучаются в первую очередь,
+        # модели фоновых задач -- после всех запросов пользователей
+        if _background.get():
+            priority, label = 2, 'background'
+        elif default_parameters(model_class) == parameters:
+            priority, label = 0, 'default'
+        else:
+            priority, label = 1, 'custom'
+        with AdmissionSingleton.get().admit(priority, label):
+            # пока запрос ждал в очереди, модель могли обучить
+            approximator = registry.get(key)
+            if approximator is None:
+                approximator = _fit_model(model_class, parameters, city,
+                                          use_date_from, use_date_to, time)
+                with profiling.timer('registry_put'):
+                    registry.put(key, approximator)
+
+    return Forecast(
+        approximator,
+        (datetime.strptime(use_date_to, '%d.%m.%Y')
+            + timedelta(days=1)).strftime('%d.%m.%Y'))
+
+
+def default_parameters(model_class):
+    r"""
+    Возвращает нормализованные параметры модели по умолчанию (те, что
+    выставлены на главной странице).
 
-    while 'LastEvaluatedKey' in response:
-        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-        yield from response['Items']
+    :rtype: dict
+    """
+    return model_class(**{
+        key: value['default'] for key, value
+        in model_class._parameters.items()}).get_parameters()
+
+
+def warmup(fit_cities=()):
+    r"""
+    Готовит процесс к обслуживанию запросов: импортирует библиотеки
+    моделей, загружает данные всех регионов в :class:`SeriesSnapshot` и
+    обучает модели с параметрами по умолчанию для городов fit_cities на
+    окне обучения главной страницы. Вызывается в главном процессе gunicorn
+    до fork, чтобы рабочие процессы начинали работу с готовыми кешами.
+
+    :param fit_cities: города, для которых обучить модели, либо ['all']
+    :type fit_cities: list
+    """
+    LoggerSinglton.init()
+    for module in ('pandas', 'scipy.interpolate', 'sklearn.linear_model',
+                   'statsmodels.tsa.arima.model'):
+        importlib.import_module(module)
+
+    snapshot = SeriesSnapshotSingleton.load()
+    logging.info('loaded {} regions'.format(len(snapshot.cities())))
+
+    if list(fit_cities) == ['all']:
+        fit_cities = snapshot.cities()
+    use_date_from, use_date_to = get_dates(next(iter(get_cities())))
+    for city in fit_cities:
+        for model, value in get_models().items():
+            parameters = default_parameters(value['model'])
+            _fit(city, model, json.dumps(parameters, sort_keys=True),
+                 use_date_from, use_date_to, get_region_version(city))
+        logging.info('fitted default models for {}'.format(city))
+
+
+def after_fork():
+    r"""
+    Вызывается в рабочем процессе после fork: соединение с базой
+    не должно использоваться несколькими процессами, а поток записи
+    журнала главного процесса в рабочий не переходит.
+    """
+    storage.DynamoDBSingleton._dynamodb = None
+    StorageSingleton._storage = None
+    LoggerSinglton.after_fork()
+
+
+def _fit_model(model_class, parameters, city, use_date_from, use_date_to,
+               time=None):
+    r"""
+    Обучает модель model_class с параметрами parameters на данных города
+    city версии time в окне обучения.
+
+    :rtype: covidlib.approximator.Approximator
+    """
+    if 'n_jobs' in inspect.signature(model_class).parameters:
+        parameters = dict(parameters, n_jobs=models_n_jobs)
+    approximator = model_class(**parameters)
+    approximator.fit(get_features(city, time, use_date_from, use_date_to))
+    return approximator
+
+
+@lru_cache(maxsize=1024)
+def get_features(city, time=None, use_date_from=None, use_date_to=None):
+    r"""
+    Возвращает признаки данных города версии time (см.
+    :class:`covidlib.FeatureFrame`), на которых обучаются модели. Признаки
+    считаются один раз на версию данных и окно обучения и общие для всех
+    моделей.
+
+    :param time: версия данных города, см. :func:`get_region_version`
+    :type time: str
+
+    :param use_date_from: начало окна обучения (None -- все данные)
+    :type use_date_from: str
+
+    :param use_date_to: конец окна обучения
+    :type use_date_to: str
+
+    :rtype: covidlib.FeatureFrame
+    """
+    if use_date_from is None:
+        data = get_city_statistic(city, time)
+        with profiling.timer('features'):
+            return covidlib.FeatureFrame.from_data(data)
+
+    frame = get_features(city, time)
+    with profiling.timer('features'):
+        return frame.window(use_date_from, use_date_to)
 
-def get_stats():
-    dynamodb = DynamoDBSingleton.get()
-    table = dynamodb.Table('cities')
 
+def get_dates(city):
+    item = StorageSingleton.get().get_city(city)
+
+    if item is None:
+        return '01.01.2020', '01.10.2020'
+
+    return item['from_'], item['to_']
+
+def get_stats():
     cities = dict()
-    for item in scan_table(table):
+    for item in StorageSingleton.get().scan_cities():
         cities[item['id']] = dict()
         cities[item['id']]['name'] = item['name']
         cities[item['id']]['from'] = item['from_']
@@ -368,13 +1470,8 @@ def get_stats():
     return cities
 
 def get_cities():
-    dynamodb = DynamoDBSingleton.get()
-    table = dynamodb.Table('cities')
-
-    cities = dict()
-
     cities = dict()
-    for item in scan_table(table):
+    for item in StorageSingleton.get().scan_cities():
         cities[item['id']] = item['name']
 
     cities = {key: cities[key] for key in sorted(cities)}
@@ -382,8 +1479,12 @@ def get_cities():
     sorted_cities = {'RU-MOW': cities['RU-MOW'],
                      'RU-MOS': cities['RU-MOS'],
                      'RU-SPE': cities['RU-SPE']}
+    # после них -- страна и федеральные округа
+    sorted_cities.update(
+        {key: cities[key] for key in get_aggregates() if key in cities})
     sorted_cities.update(
-        {key: cities[key]  for key in sorted(cities) if key not in {'RU-MOW', 'RU-MOS', 'RU-SPE'}})
+        {key: cities[key] for key in sorted(cities)
+         if key not in sorted_cities})
 
     return sorted_cities
 
@@ -407,13 +1508,18 @@ def get_models(with_approximator=True):
     return models
 
 
-def get_city_statistic(city):
+def get_city_statistic(city, time=None):
     r"""
     Возвращает данные для соответствующего города
 
     :param city: город для которого вернуть данные
     :type city: str
 
+    :param time: версия данных города (см. :func:`get_region_version`);
+        если данные этой версии есть в снимке данных (см. :func:`warmup`),
+        они берутся из него без запроса к базе
+    :type time: str
+
     :return: вовзращает данные для соответсвующего города.
              данные это словарь
                 key - номер объекта,
@@ -423,20 +1529,69 @@ def get_city_statistic(city):
                                'died': int}
     :rtype: dict
     """
-    dynamodb = DynamoDBSingleton.get()
-    table = dynamodb.Table('cities')
-    response = table.get_item(Key={'id': city})
+    snapshot = SeriesSnapshotSingleton.get()
+    if time is not None and snapshot is not None and city in snapshot:
+        current = RegionVersionsSingleton.get().get(city)
+        if (current is not None and current[1] == snapshot.hash(city)
+                and '{}.{}'.format(*current) == time):
+            with profiling.timer('snapshot_read'):
+                return snapshot.get(city)
 
-    if 'Item' not in response:
-        return dict()
-    load = json.loads(response['Item']['data_'])
+    return StorageSingleton.get().get_data(city)
 
-    dict_ = dict()
-    for key in load:
-        dict_[int(key)] = load[key]
 
-    return dict_
+def add_statistics(data):
+    r"""
+    Добавляет данные городов в снимок данных (прежние данные этих городов
+    заменяются), откуда их берет :func:`get_city_statistic`.
 
+    :param data: словарь {город: данные в формате get_city_statistic}
+    :type data: dict
+    """
+    snapshot = SeriesSnapshotSingleton.get_or_create()
+    for city in data:
+        if data[city] and snapshot.hash(city) != storage.content_hash(
+                data[city]):
+            snapshot.add(city, data[city])
+
+
+def read_statistics(cities):
+    r"""
+    Читает из базы одним запросом данные городов cities вместе с версиями
+    данных (см. :func:`get_region_version`). Если прочитанные данные
+    новее известных процессу версий, версии перечитываются.
+
+    :type cities: list
+
+    :return: пара ({город: данные}, {город: версия данных}), версия
+        None -- города нет
+    :rtype: tuple
+    """
+    data = StorageSingleton.get().get_data_many(cities)
+    versions = RegionVersionsSingleton.get()
+    for city in data:
+        current = versions.get(city)
+        # у городов, записанных до появления хешей, хеша нет
+        if data[city] and (current is None or current[1] is not None
+                           and current[1] != storage.content_hash(data[city])):
+            versions.refresh()
+            break
+    return data, {city: get_region_version(city) for city in cities}
+
+
+def prefetch_statistics(cities):
+    r"""
+    Читает из базы одним запросом данные городов cities (см.
+    :func:`read_statistics`) и добавляет их в снимок данных.
+
+    :type cities: list
+
+    :return: словарь {город: версия данных}, версия None -- города нет
+    :rtype: dict
+    """
+    data, versions = read_statistics(cities)
+    add_statistics(data)
+    return versions
 
 def get_data_field():
     r"""
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+r"""
+Асинхронный (ASGI) режим сервиса::
+
+    uvicorn asgi:app --port 8080
+
+Прогнозы ``/json/<city>`` и ``/batch`` считаются в пуле процессов,
+обращения к базе
+выполняются в отдельном пуле потоков, поэтому цикл событий не блокируется
+и легкие страницы (``/``, ``/stats``, ``/metrics``) отвечают, даже если
+в очереди много долгих прогнозов. Остальные маршруты обслуживает
+Flask-приложение из :mod:`server`.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import api
+from api import get_region_version, profiling, request_etag
+from covidlib import admission, cancellation
+import server
+
+# количество процессов, считающих прогнозы
+forecast_workers = int(os.environ.get(
+    'FORECAST_WORKERS', str(os.cpu_count() or 1)))
+# количество потоков для запросов к базе
+io_threads = int(os.environ.get('IO_THREADS', '16'))
+
+# как часто проверяется, не отключился ли клиент
+_DISCONNECT_POLL = 0.5
+
+profiling.describe('covid_forecast_pool_pending', 'gauge',
+                   'Forecasts submitted to the process pool')
+
+_io_pool = ThreadPoolExecutor(io_threads, thread_name_prefix='io')
+_forecast_pool = None
+# прогнозы, отправленные в пул и еще не посчитанные
+_pending = 0
+
+
+def _get_forecast_pool():
+    global _forecast_pool
+    if _forecast_pool is None:
+        # spawn: к моменту запуска процессов в сервере уже работают потоки
+        _forecast_pool = ProcessPoolExecutor(
+            forecast_workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=api.LoggerSinglton.init)
+    return _forecast_pool
+
+
+def _forecast(args, version, timeout, data=None, serialize=True):
+    r"""
+    Считает прогноз в процессе пула. Выполняется в дочернем процессе,
+    поэтому кеши обученных моделей у каждого процесса свои (реестр
+    моделей на диске общий).
+
+    :param timeout: сколько секунд может считаться прогноз
+        (0 -- без ограничения)
+    :type timeout: float
+
+    :param data: уже прочитанные данные городов {город: данные}, см.
+        :func:`api.add_statistics`
+    :type data: dict
+
+    :param serialize: вернуть прогноз в формате JSON
+    :type serialize: bool
+
+    :return: прогноз
+    :rtype: str
+    """
+    if data:
+        api.add_statistics(data)
+    deadline = None
+    if timeout > 0:
+        deadline = time.monotonic() + timeout
+    with cancellation.scope(cancellation.CancelToken(deadline=deadline)):
+        approx = api.approximate(*args, time=version)
+    if not serialize:
+        return approx
+    with profiling.timer('serialization'):
+        return json.dumps(approx)
+
+
+async def _wait(request, future):
+    r"""
+    Ждет результат future. Если клиент отключился, задача снимается
+    с очереди пула (уже начатый прогноз досчитывается).
+    """
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=_DISCONNECT_POLL)
+        if done:
+            return future.result()
+        if await request.is_disconnected():
+            future.cancel()
+            raise cancellation.Cancelled('disconnect')
+
+
+def _submit(*args):
+    r"""
+    Отправляет прогноз в пул процессов, если очередь пула не переполнена
+    (она ограничена так же, как очередь обучения моделей).
+
+    :return: asyncio future либо None, если очередь переполнена
+    """
+    global _pending
+    if _pending >= forecast_workers + api.fit_queue_size:
+        profiling.inc('covid_admission_rejected_total')
+        return None
+
+    def release(_):
+        global _pending
+        _pending -= 1
+        profiling.set_gauge('covid_forecast_pool_pending', _pending)
+
+    future = asyncio.wrap_future(_get_forecast_pool().submit(_forecast, *args))
+    _pending += 1
+    profiling.set_gauge('covid_forecast_pool_pending', _pending)
+    future.add_done_callback(release)
+    return future
+
+
+async def _completed(request, futures):
+    r"""
+    Перебирает future по мере готовности. Если клиент отключился,
+    оставшиеся задачи снимаются с очереди пула.
+
+    :param futures: словарь {future: значение}
+    :type futures: dict
+
+    :return: асинхронный генератор пар (значение, future)
+    """
+    waiting = dict(futures)
+    try:
+        while waiting:
+            done, _ = await asyncio.wait(set(waiting),
+                                         timeout=_DISCONNECT_POLL)
+            for future in done:
+                yield waiting.pop(future), future
+            if not done and await request.is_disconnected():
+                raise cancellation.Cancelled('disconnect')
+    finally:
+        for future in waiting:
+            future.cancel()
+
+
+def _logged(handler):
+    r"""
+    Декоратор обработчика: запрос получает идентификатор (см.
+    :func:`api.begin_request`), который возвращается в заголовке
+    X-Request-ID, а по окончании обработки в журнал пишется запись
+    о запросе, как в :func:`server.end_timing`.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request):
+        request_id = api.begin_request(request.headers.get('x-request-id'))
+        response = await handler(request)
+        response.headers['X-Request-ID'] = request_id
+        api.end_request(method=request.method, path=request.url.path,
+                        endpoint=handler.__name__,
+                        status=response.status_code)
+        return response
+    return wrapper
+
+
+def _etag_matches(header, etag):
+    tags = [tag.strip() for tag in header.split(',')]
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    return '*' in tags or '"{}"'.format(etag) in tags
+
+
+@_logged
+async def get_json(request):
+    start = time.perf_counter()
+    city = request.path_params['city']
+    loop = asyncio.get_running_loop()
+
+    args = server.forecast_request(city, request.query_params)
+    version = await loop.run_in_executor(_io_pool, get_region_version, city)
+    if version is None:
+        return Response(status_code=404)
+    etag = request_etag(args, version)
+    # браузер хранит ответ, но перед использованием проверяет его по ETag
+    headers = {'ETag': '"{}"'.format(etag), 'Cache-Control': 'no-cache'}
+
+    if _etag_matches(request.headers.get('if-none-match', ''), etag):
+        profiling.inc('covid_not_modified_total')
+        response = Response(status_code=304, headers=headers)
+    else:
+        future = _submit(args, version, server.forecast_deadline)
+        if future is None:
+            return Response(status_code=429, headers={'Retry-After': '1'})
+        try:
+            approx = await _wait(request, future)
+        except cancellation.Cancelled as e:
+            logging.info('forecast for {} cancelled: {}'.format(
+                city, e.reason))
+            profiling.inc('covid_cancelled_jobs_total', reason=e.reason)
+            return Response(status_code=504 if e.reason == 'deadline'
+                            else 499)
+        except admission.Overloaded as e:
+            return Response(status_code=429,
+                            headers={'Retry-After': str(e.retry_after)})
+        response = Response(approx, media_type='application/json',
+                            headers=headers)
+
+    if profiling.is_enabled():
+        profiling.observe('covid_request_seconds',
+                          time.perf_counter() - start, endpoint='get_json')
+    return response
+
+
+@_logged
+async def batch(request):
+    r"""Асинхронный вариант :func:`server.batch`."""
+    loop = asyncio.get_running_loop()
+    try:
+        requests = server.batch_requests(await request.json())
+    except (KeyError, TypeError, ValueError):
+        return Response(status_code=400)
+    if len(requests) > server.batch_max_jobs:
+        return Response(status_code=413)
+
+    unique = dict()
+    for index, args in enumerate(requests):
+        unique.setdefault(args, []).append(index)
+    # данные всех городов читаются одним запросом и передаются в пул
+    data, versions = await loop.run_in_executor(
+        _io_pool, api.read_statistics, [args[0] for args in unique])
+
+    records = []
+    futures = dict()
+    for args, indexes in unique.items():
+        city = args[0]
+        if versions[city] is None:
+            records.extend(server.batch_record(
+                index, args, api.UnknownRegion(city)) for index in indexes)
+            continue
+        future = _submit(args, versions[city], server.forecast_deadline,
+                         {city: data[city]}, False)
+        if future is None:
+            records.extend(server.batch_record(
+                index, args, admission.Overloaded(1)) for index in indexes)
+        else:
+            futures[future] = indexes
+
+    async def results():
+        for record in records:
+            yield record
+        try:
+            async for indexes, future in _completed(request, futures):
+                if future.cancelled():
+                    continue
+                try:
+                    result = future.result()
+                except (admission.Overloaded, cancellation.Cancelled) as e:
+                    result = e
+                except Exception as e:
+                    # ошибка одного задания не прерывает остальные
+                    logging.warning('batch job for {} failed: {!r}'.format(
+                        requests[indexes[0]][0], e))
+                    result = e
+                for index in indexes:
+                    yield server.batch_record(index, requests[index], result)
+        except cancellation.Cancelled as e:
+            logging.info('batch forecast cancelled: {}'.format(e.reason))
+            profiling.inc('covid_cancelled_jobs_total', reason=e.reason)
+
+    if request.query_params.get('stream') == '1':
+        async def lines():
+            async for record in results():
+                yield json.dumps(record) + '\n'
+        return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+    records = [record async for record in results()]
+    records.sort(key=lambda record: record['index'])
+    return Response(json.dumps({'results': records}),
+                    media_type='application/json')
+
+
+app = Starlette(routes=[
+    Route('/json/{city}', get_json, methods=['GET']),
+    Route('/batch', batch, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(server.app)),
+])
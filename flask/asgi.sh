@@ -0,0 +1,3 @@
+#!/bin/bash
+PYTHONPATH=. python3 -c "from api import init_base; init_base()"
+PYTHONPATH=. uvicorn asgi:app --host 0.0.0.0 --port $1
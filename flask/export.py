@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+r"""
+Выгрузка прогнозов всех регионов в один колоночный файл (Parquet либо
+Arrow IPC) для аналитики: реальные данные и прогнозы всех моделей
+с параметрами по умолчанию, обученных на всех данных региона.
+
+Файл строится потоково -- по одной группе строк на регион, поэтому память
+не растет с числом регионов. Строка файла -- один день одного ряда:
+city, model (``real`` для реальных данных), date, sick, recovered, died.
+Для выгрузки нужен pyarrow.
+
+Выгрузка выполняется синхронно в потоке запроса POST /export и обучает
+модели всех регионов по очереди. Модели обучаются в фоновом режиме (см.
+:func:`api.background`): они ждут в очереди допуска после моделей
+запросов пользователей, а если их вытеснили из заполненной очереди,
+выгрузка прерывается с :class:`covidlib.admission.Overloaded` и
+повторяется позже; уже обученные модели остаются в реестре.
+"""
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+
+import api
+from covidlib import admission, cancellation
+
+# директория выгрузки
+export_path = Path(os.environ.get('EXPORT_PATH', 'data/export')).resolve()
+# на сколько дней после окна обучения строится прогноз
+export_horizon = int(os.environ.get('EXPORT_HORIZON', '14'))
+
+# формат: (имя файла, mimetype)
+FORMATS = {'parquet': ('forecasts.parquet', 'application/octet-stream'),
+           'arrow': ('forecasts.arrow', 'application/vnd.apache.arrow.file')}
+
+
+def get_path(format_='parquet'):
+    r"""
+    Возвращает путь к файлу выгрузки в формате format_.
+
+    :rtype: pathlib.Path
+    """
+    return export_path / FORMATS[format_][0]
+
+
+def default_models():
+    r"""
+    Возвращает модели с параметрами по умолчанию (как на главной
+    странице) в формате параметра models :func:`api.approximate`.
+
+    :rtype: dict
+    """
+    return {model: {'parameters': api.default_parameters(value['model'])}
+            for model, value in api.get_models().items()}
+
+
+def forecast(city, dates, version):
+    r"""
+    Возвращает реальные данные и прогнозы всех моделей с параметрами
+    по умолчанию (в формате :func:`api.approximate`) на export_horizon дней
+    после окна обучения. Модели, которые не удалось обучить на данных
+    региона, пропускаются.
+
+    :param dates: окно обучения (use_date_from, use_date_to) -- первый
+        и последний день данных региона
+    :type dates: tuple
+
+    :param version: версия данных города, см. :func:`api.get_region_version`
+    :type version: str
+
+    :rtype: dict
+    """
+    predict_date_to = datetime.strptime(dates[1], '%d.%m.%Y') + timedelta(
+        days=export_horizon)
+    date = json.dumps({'use_date_from': dates[0], 'use_date_to': dates[1],
+                       'predict_date_to': predict_date_to.strftime(
+                           '%d.%m.%Y')})
+
+    def approximate(models):
+        city_, models, date_, fields, _ = api.canonical_request(
+            city, json.dumps(models), date)
+        # результат не кладется в кеш прогнозов, чтобы память не росла
+        # с числом регионов; обученные модели берутся из кеша и реестра
+        return api.forecast_region(city_, models, date_, version, fields)
+
+    approx = approximate(dict())
+    for model, parameters in default_models().items():
+        try:
+            approx[model] = approximate({model: parameters})[model]
+        except (admission.Overloaded, cancellation.Cancelled):
+            raise
+        except Exception as e:
+            logging.warning('export: {} failed for {}: {!r}'.format(
+                model, city, e))
+    return approx
+
+
+def _columns(city, approx):
+    r"""
+    Переводит прогноз :func:`api.approximate` в столбцы выгрузки.
+
+    :rtype: dict
+    """
+    fields = list(api.get_data_field())
+    columns = {key: [] for key in ['city', 'model', 'date'] + fields}
+    for model, records in approx.items():
+        for key in sorted(records):
+            record = records[key]
+            columns['city'].append(city)
+            columns['model'].append(model)
+            columns['date'].append(
+                datetime.strptime(record['date'], '%d.%m.%Y').date())
+            for field in fields:
+                value = record.get(field)
+                columns[field].append(
+                    float(value) if value is not None else None)
+    return columns
+
+
+def _open_writer(path, schema, format_):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if format_ == 'parquet':
+        return pq.ParquetWriter(path, schema)
+    return pa.ipc.new_file(path, schema)
+
+
+def _read_key(path, format_):
+    r"""Возвращает ключ уже выгруженного файла либо None."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if not path.exists():
+        return None
+    if format_ == 'parquet':
+        schema = pq.read_schema(str(path))
+    else:
+        with pa.memory_map(str(path)) as source:
+            schema = pa.ipc.open_file(source).schema
+    return (schema.metadata or dict()).get(b'key', b'').decode('utf-8')
+
+
+def run(format_='parquet', force=False):
+    r"""
+    Выгружает прогнозы всех регионов в файл :func:`get_path`. Файл
+    заменяется атомарно; если версии данных регионов и горизонт прогноза
+    не изменились с прошлой выгрузки, файл не перестраивается.
+
+    :param format_: parquet либо arrow
+    :type format_: str
+
+    :param force: перестроить файл в любом случае
+    :type force: bool
+
+    :return: True, если файл перестроен
+    :rtype: bool
+    """
+    import pyarrow as pa
+
+    api.LoggerSinglton.init()
+    path = get_path(format_)
+    cities = api.get_stats()
+    versions = {city: api.get_region_version(city) for city in cities}
+    key = json.dumps({'versions': versions, 'horizon': export_horizon},
+                     sort_keys=True)
+    if not force and _read_key(path, format_) == key:
+        logging.info('export {} is up to date'.format(format_))
+        return False
+
+    logging.info('start export {}'.format(format_))
+    fields = list(api.get_data_field())
+    schema = pa.schema(
+        [('city', pa.string()), ('model', pa.string()),
+         ('date', pa.date32())] + [(field, pa.float64()) for field in fields],
+        metadata={'key': key})
+
+    export_path.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=str(export_path), suffix='.tmp')
+    os.close(fd)
+    try:
+        writer = _open_writer(tmp, schema, format_)
+        try:
+            with api.background():
+                for city in cities:
+                    approx = forecast(
+                        city, (cities[city]['from'], cities[city]['to']),
+                        versions[city])
+                    writer.write_table(pa.Table.from_pydict(
+                        _columns(city, approx), schema=schema))
+        finally:
+            writer.close()
+        os.replace(tmp, str(path))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    logging.info('end export {}: {} regions'.format(format_, len(cities)))
+    return True
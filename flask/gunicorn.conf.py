@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+r"""
+Настройки gunicorn (см. flask.sh).
+
+При PRELOAD=1 приложение загружается в главном процессе: до fork
+импортируются библиотеки моделей, данные всех регионов загружаются
+в компактные массивы и (при PRELOAD_FIT) обучаются модели с параметрами
+по умолчанию. Рабочие процессы получают все это через общую память
+(copy-on-write) и сразу отвечают на первые запросы.
+"""
+import gc
+import os
+
+preload_app = os.environ.get('PRELOAD', '0') == '1'
+# города (через запятую) либо all, для которых обучить модели до fork
+preload_fit = [city for city in os.environ.get('PRELOAD_FIT', '').split(',')
+               if city]
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+
+    import api
+
+    api.warmup(preload_fit)
+    # сборщик мусора пишет в заголовки объектов, из-за чего общие страницы
+    # копируются в каждый рабочий процесс; загруженные до fork объекты
+    # из его обхода исключаются
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+
+    import api
+
+    api.after_fork()
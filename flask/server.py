@@ -1,19 +1,109 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import os
+import select
+import socket
 from datetime import datetime
 from datetime import timedelta
+import time
 
-from flask import render_template, Flask, request, Response
+from flask import render_template, Flask, request, Response, g, send_file
 
 from api import (approximate, get_cities, get_data_field, get_models, get_dates,
-                 update_data, LoggerSinglton, get_stats)
+                 update_data, LoggerSinglton, get_stats, profiling,
+                 canonical_request, get_region_version, request_etag,
+                 approximate_many, get_series, begin_request, end_request,
+                 UnknownRegion)
+from covidlib import admission, cancellation
+import export
 
 
 app = Flask(__name__)
 
 LoggerSinglton.init()
 
+timing_header = os.environ.get('PROFILING_HEADER', '0') == '1'
+# сколько секунд может считаться прогноз (0 -- без ограничения)
+forecast_deadline = float(os.environ.get('FORECAST_DEADLINE', '0'))
+# обучать модели в дочерних процессах, чтобы отмена прерывала обучение
+forecast_isolate = os.environ.get('FORECAST_ISOLATE', '0') == '1'
+# наибольшее число заданий в пакетном запросе /batch
+batch_max_jobs = int(os.environ.get('BATCH_MAX_JOBS', '100'))
+
+profiling.describe('covid_request_seconds', 'summary',
+                   'Time spent in a request by endpoint')
+profiling.describe('covid_not_modified_total', 'counter',
+                   'Forecast requests answered with 304 Not Modified')
+profiling.describe('covid_cancelled_jobs_total', 'counter',
+                   'Forecast computations cancelled by reason')
+
+
+def disconnect_probe(environ):
+    r"""
+    Возвращает функцию, которая проверяет, не закрыл ли клиент соединение.
+    Сокет клиента доступен только под gunicorn (gunicorn.socket), в
+    остальных случаях возвращается None.
+
+    :rtype: callable
+    """
+    sock = environ.get('gunicorn.socket')
+    if sock is None:
+        return None
+
+    def probe():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            # закрытый сокет читается без блокировки и отдает 0 байт
+            if readable and not sock.recv(1, socket.MSG_PEEK):
+                return 'disconnect'
+        except (OSError, ValueError):
+            return 'disconnect'
+        return None
+
+    return probe
+
+
+def cancel_token():
+    r"""
+    Признак отмены для прогноза текущего запроса: по истечении
+    FORECAST_DEADLINE секунд либо при отключении клиента.
+
+    :rtype: cancellation.CancelToken
+    """
+    deadline = None
+    if forecast_deadline > 0:
+        deadline = time.monotonic() + forecast_deadline
+    return cancellation.CancelToken(
+        deadline=deadline, probe=disconnect_probe(request.environ),
+        isolate=forecast_isolate)
+
+@app.before_request
+def begin_timing():
+    g.request_id = begin_request(request.headers.get('X-Request-ID'))
+    if profiling.is_enabled():
+        g.request_start = time.perf_counter()
+        profiling.begin_collect()
+
+@app.after_request
+def end_timing(response):
+    fields = dict()
+    if profiling.is_enabled() and 'request_start' in g:
+        records = profiling.end_collect()
+        profiling.observe('covid_request_seconds',
+                          time.perf_counter() - g.request_start,
+                          endpoint=request.endpoint or '')
+        if timing_header and records:
+            response.headers['X-Timing'] = profiling.format_timing(records)
+        if records:
+            fields['timing'] = profiling.timing_fields(records)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+        end_request(method=request.method, path=request.path,
+                    endpoint=request.endpoint or '',
+                    status=response.status_code, **fields)
+    return response
+
 @app.route('/')
 @app.route('/main')
 def main():
@@ -49,15 +139,28 @@ def stats():
     return Response(json.dumps(get_stats()), mimetype='application/json')
 
 
+@app.route('/metrics')
+def metrics():
+    return Response(profiling.render_prometheus(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/update', methods=['GET'])
 def update():
     return Response(json.dumps(update_data()), mimetype='application/json')
 
 
-@app.route('/json/<city>', methods=['GET'])
-def get_json(city):
+def forecast_request(city, params):
+    r"""
+    Разбирает параметры запроса прогноза ``/json/<city>``.
+
+    :param params: параметры запроса (models, fields, date, interval)
+    :type params: dict
 
-    models = request.args.get('models')
+    :return: канонический запрос, см. :func:`api.canonical_request`
+    :rtype: tuple
+    """
+    models = params.get('models')
     if models:
         models_all = json.loads(models)
         models = dict()
@@ -68,22 +171,197 @@ def get_json(city):
     else:
         models = dict()
 
-    fields = request.args.get('fields')
+    fields = params.get('fields')
     if fields:
         fields_all = json.loads(fields)
         fields = []
         for key in fields_all:
             if fields_all[key] == 1:
                 fields.append(key)
+        fields = json.dumps(fields)
     else:
-        fields = []
+        fields = None
 
-    date = request.args.get('date')
+    date = params.get('date')
     if date:
         date = json.loads(date)
     else:
         date = None
 
-    approx = approximate(city, json.dumps(models), json.dumps(date))
+    return canonical_request(
+        city, json.dumps(models), json.dumps(date), fields,
+        params.get('interval') or None)
+
+
+@app.route('/series/<city>', methods=['GET'])
+def series(city):
+    r"""
+    Данные города, измененные после версии ``since`` (см.
+    :func:`api.get_series`).
+    """
+    try:
+        series = get_series(city, request.args.get('since'))
+    except ValueError:
+        return Response(status=400)
+    with profiling.timer('serialization'):
+        series = json.dumps(series)
+    return Response(series, mimetype='application/json')
+
+
+def batch_requests(body):
+    r"""
+    Разбирает тело пакетного запроса прогнозов ``POST /batch``::
+
+        {"jobs": [{"city": ..., "models": ..., "fields": ..., "date": ...,
+                   "interval": ...}, ...]}
+
+    Параметры задания те же, что у ``/json/<city>``, но передаются
+    объектами JSON, а не строками.
+
+    :return: список канонических запросов, см. :func:`forecast_request`
+    :rtype: list
+    """
+    return [forecast_request(job['city'], {
+        key: json.dumps(job[key]) for key in
+        ('models', 'fields', 'date', 'interval') if job.get(key) is not None})
+        for job in body['jobs']]
+
+
+def batch_record(index, request, result):
+    r"""
+    Возвращает запись ответа на задание index пакетного запроса.
+
+    :param request: канонический запрос задания
+    :type request: tuple
+
+    :param result: прогноз либо исключение, которым завершился его расчет
+        (:class:`admission.Overloaded`, :class:`cancellation.Cancelled`;
+        :class:`api.UnknownRegion` дает статус 404, ошибки в параметрах
+        и данных задания -- KeyError, TypeError, ValueError -- статус 400,
+        остальные исключения -- 500)
+
+    :rtype: dict
+    """
+    record = {'index': index, 'city': request[0]}
+    if isinstance(result, admission.Overloaded):
+        record.update(status=429, retry_after=result.retry_after)
+    elif isinstance(result, cancellation.Cancelled):
+        record['status'] = 504 if result.reason == 'deadline' else 499
+    elif isinstance(result, UnknownRegion):
+        record.update(status=404, error='unknown region')
+    elif isinstance(result, (KeyError, TypeError, ValueError)):
+        record.update(status=400, error=repr(result))
+    elif isinstance(result, Exception):
+        record.update(status=500, error=repr(result))
+    else:
+        record.update(status=200, result=result)
+    return record
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    r"""
+    Пакетный запрос прогнозов (см. :func:`batch_requests`). Одинаковые
+    задания считаются один раз, разные -- параллельно. Ответ --
+    ``{"results": [...]}`` с записями :func:`batch_record` в порядке
+    заданий, а при ``?stream=1`` -- по строке JSON на задание
+    (application/x-ndjson) в порядке готовности.
+    """
+    try:
+        requests = batch_requests(request.get_json(force=True))
+    except (KeyError, TypeError, ValueError):
+        return Response(status=400)
+    if len(requests) > batch_max_jobs:
+        return Response(status=413)
+
+    token = cancel_token()
+
+    def records():
+        reported = set()
+        try:
+            with cancellation.scope(token):
+                for indexes, result in approximate_many(requests):
+                    for index in indexes:
+                        reported.add(index)
+                        yield batch_record(index, requests[index], result)
+        except cancellation.Cancelled as e:
+            logging.info('batch forecast cancelled: {}'.format(e.reason))
+            profiling.inc('covid_cancelled_jobs_total', reason=e.reason)
+            for index in range(len(requests)):
+                if index not in reported:
+                    yield batch_record(index, requests[index], e)
+
+    if request.args.get('stream') == '1':
+        return Response((json.dumps(record) + '\n' for record in records()),
+                        mimetype='application/x-ndjson')
+
+    results = sorted(records(), key=lambda record: record['index'])
+    with profiling.timer('serialization'):
+        results = json.dumps({'results': results})
+    return Response(results, mimetype='application/json')
+
+
+@app.route('/export', methods=['GET'])
+def get_export():
+    r"""
+    Отдает файл выгрузки прогнозов всех регионов (см. :mod:`export`)
+    в формате format (parquet либо arrow).
+    """
+    format_ = request.args.get('format', 'parquet')
+    if format_ not in export.FORMATS:
+        return Response(status=400)
+    path = export.get_path(format_)
+    if not path.exists():
+        return Response(status=404)
+    return send_file(str(path), mimetype=export.FORMATS[format_][1],
+                     as_attachment=True, conditional=True)
+
+
+@app.route('/export', methods=['POST'])
+def build_export():
+    r"""Перестраивает файл выгрузки прогнозов, если данные изменились."""
+    format_ = request.args.get('format', 'parquet')
+    if format_ not in export.FORMATS:
+        return Response(status=400)
+    try:
+        written = export.run(format_)
+    except admission.Overloaded as e:
+        return Response(status=429,
+                        headers={'Retry-After': str(e.retry_after)})
+    return Response(json.dumps({'written': written}),
+                    mimetype='application/json')
+
+
+@app.route('/json/<city>', methods=['GET'])
+def get_json(city):
+    args = forecast_request(city, request.args)
+    version = get_region_version(city)
+    if version is None:
+        return Response(status=404)
+    etag = request_etag(args, version)
+    if etag in request.if_none_match:
+        profiling.inc('covid_not_modified_total')
+        response = Response(status=304)
+    else:
+        try:
+            with cancellation.scope(cancel_token()):
+                approx = approximate(*args, time=version)
+        except cancellation.Cancelled as e:
+            logging.info('forecast for {} cancelled: {}'.format(
+                city, e.reason))
+            profiling.inc('covid_cancelled_jobs_total', reason=e.reason)
+            # ответ на отключение клиента уже никто не прочитает
+            return Response(status=504 if e.reason == 'deadline' else 499)
+        except admission.Overloaded as e:
+            return Response(status=429,
+                            headers={'Retry-After': str(e.retry_after)})
+
+        with profiling.timer('serialization'):
+            approx = json.dumps(approx)
+
+        response = Response(approx, mimetype='application/json')
 
-    return Response(json.dumps(approx), mimetype='application/json')
+    # браузер хранит ответ, но перед использованием проверяет его по ETag
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
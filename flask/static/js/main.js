@@ -87,7 +87,17 @@ function parse_json_to_graph(data, field=null) {
     });
 }
 
-function plot_graph_from_json(city=null, model=null, date=true, field=null) {
+var plot_timer = null;
+var plot_request = null;
+
+function plot_graph_from_json(city=null, model=null, date=true, field=null, delay=300) {
+    clearTimeout(plot_timer);
+    plot_timer = setTimeout(function () {
+        request_graph_from_json(city, model, date, field);
+    }, delay);
+}
+
+function request_graph_from_json(city=null, model=null, date=true, field=null) {
     if(!city){
         city = document.getElementById("cities").value;
     }
@@ -127,11 +137,15 @@ function plot_graph_from_json(city=null, model=null, date=true, field=null) {
         var tmp_predict_date_to = new Date(document.getElementById("predict_date_to").value)
         var tmp_use_date_from = new Date(document.getElementById("use_date_from").value)
         var tmp_use_date_to = new Date(document.getElementById("use_date_to").value)
+        var tmp_plot_date_from = new Date(document.getElementById("plot_date_from").value)
+        var tmp_plot_date_to = new Date(document.getElementById("plot_date_to").value)
 
         var date = {
             predict_date_to: tmp_predict_date_to.toLocaleDateString('ru'),
             use_date_from: tmp_use_date_from.toLocaleDateString('ru'),
             use_date_to: tmp_use_date_to.toLocaleDateString('ru'),
+            plot_date_from: tmp_plot_date_from.toLocaleDateString('ru'),
+            plot_date_to: tmp_plot_date_to.toLocaleDateString('ru'),
         };
 
         url = url + `&date=${JSON.stringify(date)}`;
@@ -139,11 +153,19 @@ function plot_graph_from_json(city=null, model=null, date=true, field=null) {
 
     url = url.replace('&', '?')
     
+    if(plot_request){
+        plot_request.abort();
+    }
+
     const http = new XMLHttpRequest();
+    plot_request = http;
     http.open("GET", url, true);
     http.onreadystatechange = function () {
-        if(http.readyState === XMLHttpRequest.DONE && http.status === 200) {
-            parse_json_to_graph(JSON.parse(http.responseText), fields)
+        if(http.readyState === XMLHttpRequest.DONE && http === plot_request) {
+            plot_request = null;
+            if(http.status === 200) {
+                parse_json_to_graph(JSON.parse(http.responseText), fields)
+            }
         };
     }
     http.send();
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+r"""
+Хранилища данных сервиса: таблица городов (название, первый и последний
+день данных, ряды заболевших, выздоровевших и умерших по дням) и
+метаданные обновления базы (date_ -- версия данных, last_try_ -- время
+последней попытки обновления).
+"""
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+import covidlib
+
+profiling = covidlib.profiling
+
+
+class DynamoDBSingleton(object):
+    _dynamodb = None
+
+    @staticmethod
+    def load():
+        import boto3
+
+        DynamoDBSingleton._dynamodb = boto3.resource(
+            'dynamodb',
+            region_name="us-west-2",
+            endpoint_url=os.environ.get(
+                'DYNAMODB_ENDPOINT', 'http://localhost:8000'))
+        return DynamoDBSingleton._dynamodb
+
+    @staticmethod
+    def get():
+        if DynamoDBSingleton._dynamodb is not None:
+            return DynamoDBSingleton._dynamodb
+        else:
+            return DynamoDBSingleton.load()
+
+
+def scan_table(table):
+    response = table.scan()
+    yield from response['Items']
+
+    while 'LastEvaluatedKey' in response:
+        response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+        yield from response['Items']
+
+
+def content_hash(data):
+    r"""
+    Возвращает хеш содержимого данных города (в формате
+    :func:`api.get_city_statistic`). Одинаковые данные дают одинаковый
+    хеш независимо от хранилища.
+
+    :rtype: str
+    """
+    return hashlib.sha1(json.dumps([data[key] for key in sorted(data)],
+                                   sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class Storage(ABC):
+    r"""
+    Базовый класс хранилища.
+
+    Город описывается словарем {'id', 'name', 'from_', 'to_', 'versions',
+    'hash', 'version'}, данные города -- словарем в формате
+    :func:`api.get_city_statistic`. versions -- журнал версий данных города:
+    список записей [время обновления, номер первой записи, измененной
+    в этом обновлении, номер версии данных, хеш данных]; hash -- хеш
+    данных (см. :func:`content_hash`), который хранилище записывает вместе
+    с данными (None для городов, записанных до появления хешей); version --
+    номер версии данных города, который увеличивается при каждой записи
+    его данных (0 для городов, записанных до появления номеров).
+    """
+
+    @abstractmethod
+    def create(self):
+        r"""
+        Создает пустое хранилище.
+
+        :return: False, если хранилище уже существует
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_meta(self):
+        r"""
+        Возвращает метаданные обновления базы.
+
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_meta(self, **values):
+        r"""Обновляет поля метаданных values."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_city(self, city):
+        r"""
+        Возвращает описание города либо None, если города нет.
+
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def scan_cities(self):
+        r"""Перебирает описания всех городов."""
+        raise NotImplementedError
+
+    def scan_versions(self):
+        r"""
+        Перебирает номера версий и хеши данных всех городов: словари
+        {'id', 'version', 'hash'}.
+        """
+        for item in self.scan_cities():
+            yield {key: item[key] for key in ('id', 'version', 'hash')}
+
+    @abstractmethod
+    def get_data(self, city):
+        r"""
+        Возвращает данные города (пустой словарь, если города нет).
+
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def get_data_many(self, cities):
+        r"""
+        Возвращает данные нескольких городов в формате :meth:`get_data`.
+
+        :rtype: dict
+        """
+        return {city: self.get_data(city) for city in cities}
+
+    @abstractmethod
+    def put_city(self, city, name, data, versions=None, version=1):
+        r"""
+        Записывает город с названием name, данными data, журналом версий
+        versions и номером версии данных version.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_data(self, city, data, versions=None):
+        r"""
+        Заменяет данные города (последний день берется из data) и, если
+        задан, журнал версий. Номер версии данных города увеличивается
+        на единицу.
+
+        :return: новый номер версии данных города
+        :rtype: int
+        """
+        raise NotImplementedError
+
+
+class DynamoDBStorage(Storage):
+    r"""
+    Хранилище в DynamoDB: таблицы cities (данные города хранятся
+    в атрибуте data_ в формате JSON) и meta.
+    """
+    # наибольшее число ключей в одном запросе batch_get_item
+    BATCH_SIZE = 100
+
+    @property
+    def dynamodb(self):
+        return DynamoDBSingleton.get()
+
+    def create(self):
+        def create_table(name):
+            return self.dynamodb.create_table(
+                TableName=name,
+                KeySchema=[
+                    {
+                        'AttributeName': 'id',
+                        'KeyType': 'HASH'
+                    },
+                ],
+                AttributeDefinitions=[
+                    {
+                        'AttributeName': 'id',
+                        'AttributeType': 'S'
+                    },
+                ],
+                ProvisionedThroughput={
+                    'ReadCapacityUnits': 5,
+                    'WriteCapacityUnits': 5
+                }
+            )
+
+        try:
+            create_table('cities')
+            create_table('meta')
+        except Exception:
+            return False
+        return True
+
+    def get_meta(self):
+        meta_table = self.dynamodb.Table('meta')
+        return meta_table.get_item(Key={'id': 'update'})['Item']
+
+    def update_meta(self, **values):
+        meta_table = self.dynamodb.Table('meta')
+        meta_table.update_item(
+            Key={'id': 'update'},
+            UpdateExpression='set ' + ', '.join(
+                '{0}=:{0}'.format(key) for key in values),
+            ExpressionAttributeValues={
+                ':' + key: value for key, value in values.items()},
+            ReturnValues="UPDATED_NEW")
+
+    @staticmethod
+    def _city(item):
+        city = {key: item[key] for key in ('id', 'name', 'from_', 'to_')}
+        city['versions'] = json.loads(item.get('versions_', '[]'))
+        city['hash'] = item.get('hash_')
+        city['version'] = int(item.get('version_', 0))
+        return city
+
+    def get_city(self, city):
+        table = self.dynamodb.Table('cities')
+        response = table.get_item(
+            Key={'id': city},
+            ProjectionExpression=(
+                'id, #name, from_, to_, versions_, hash_, version_'),
+            ExpressionAttributeNames={'#name': 'name'})
+        if 'Item' not in response:
+            return None
+        return self._city(response['Item'])
+
+    def scan_cities(self):
+        for item in scan_table(self.dynamodb.Table('cities')):
+            yield self._city(item)
+
+    def scan_versions(self):
+        table = self.dynamodb.Table('cities')
+        kwargs = {'ProjectionExpression': 'id, version_, hash_'}
+        while True:
+            with profiling.timer('dynamodb_read'):
+                response = table.scan(**kwargs)
+            for item in response['Items']:
+                yield {'id': item['id'],
+                       'version': int(item.get('version_', 0)),
+                       'hash': item.get('hash_')}
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def get_data(self, city):
+        with profiling.timer('dynamodb_read'):
+            table = self.dynamodb.Table('cities')
+            response = table.get_item(Key={'id': city})
+
+        if 'Item' not in response:
+            return dict()
+
+        return self._decode(response['Item'])
+
+    @staticmethod
+    def _decode(item):
+        with profiling.timer('json_decode'):
+            load = json.loads(item['data_'])
+
+            dict_ = dict()
+            for key in load:
+                dict_[int(key)] = load[key]
+
+        return dict_
+
+    def get_data_many(self, cities):
+        r"""
+        Возвращает данные нескольких городов, читая их запросами
+        batch_get_item (до :attr:`BATCH_SIZE` городов в запросе).
+
+        :rtype: dict
+        """
+        cities = list(dict.fromkeys(cities))
+        data = {city: dict() for city in cities}
+        for start in range(0, len(cities), self.BATCH_SIZE):
+            request = {'cities': {'Keys': [
+                {'id': city}
+                for city in cities[start:start + self.BATCH_SIZE]]}}
+            while request:
+                with profiling.timer('dynamodb_read'):
+                    response = self.dynamodb.batch_get_item(
+                        RequestItems=request)
+                for item in response['Responses'].get('cities', []):
+                    data[item['id']] = self._decode(item)
+                # ключи, которые база не успела прочитать, запрашиваются снова
+                request = response.get('UnprocessedKeys')
+        return data
+
+    def put_city(self, city, name, data, versions=None, version=1):
+        table = self.dynamodb.Table('cities')
+        table.put_item(
+            Item={'id': city,
+                  'name': name,
+                  'from_': data[0]['date'],
+                  'to_': data[len(data) - 1]['date'],
+                  'data_': json.dumps(data),
+                  'versions_': json.dumps(versions or []),
+                  'hash_': content_hash(data),
+                  'version_': version})
+
+    def update_data(self, city, data, versions=None):
+        values = {':date': data[len(data) - 1]['date'],
+                  ':data': json.dumps(data),
+                  ':hash': content_hash(data),
+                  ':one': 1}
+        expression = "set to_=:date, data_=:data, hash_=:hash"
+        if versions is not None:
+            values[':versions'] = json.dumps(versions)
+            expression += ", versions_=:versions"
+        # номер версии увеличивается атомарно в самой базе
+        expression += " add version_ :one"
+
+        table = self.dynamodb.Table('cities')
+        response = table.update_item(
+            Key={'id': city},
+            UpdateExpression=expression,
+            ExpressionAttributeValues=values,
+            ReturnValues="UPDATED_NEW")
+        return int(response['Attributes']['version_'])
+
+
+class MmapStorage(Storage):
+    r"""
+    Хранилище в локальных файлах. Данные всех городов хранятся в одном
+    файле -- массиве int32 размера (дни, города, поля), который читается
+    через mmap: рабочие процессы используют общие страницы кеша файловой
+    системы, а чтение ряда города не копирует файл. Описания городов,
+    поля, первый день массива и метаданные хранятся в index.json.
+
+    Запись заменяет файлы целиком (новый файл данных и атомарная замена
+    индекса), поэтому читатели всегда видят согласованное состояние;
+    уже открытые отображения старых файлов остаются корректными. Файл
+    данных прошлого поколения удаляется только следующей записью, чтобы
+    его успели открыть читатели, прочитавшие прежний индекс.
+
+    :param path: директория хранилища
+    :type path: str
+    """
+    FIELDS = ('died', 'sick', 'recovered')
+    # значение для дней, за которые у города нет данных
+    MISSING = np.iinfo(np.int32).min
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._index_path = self.path / 'index.json'
+        self._lock_path = self.path / 'lock'
+
+        self._stat = None
+        self._index = None
+        self._array = None
+
+    def _load(self):
+        r"""
+        Перечитывает индекс и данные, если они изменились. Если файл
+        данных удалили между чтением индекса и его открытием, индекс
+        читается еще раз.
+        """
+        try:
+            return self._read()
+        except FileNotFoundError:
+            return self._read()
+
+    def _read(self):
+        stat = os.stat(str(self._index_path))
+        stat = (stat.st_ino, stat.st_mtime_ns)
+        if stat != self._stat:
+            with open(str(self._index_path)) as f:
+                index = json.load(f)
+            array = None
+            if index['days']:
+                array = np.memmap(
+                    str(self.path / index['data']), dtype=np.int32, mode='r',
+                    shape=(index['days'], len(index['cities']),
+                           len(index['fields'])))
+            self._index, self._array, self._stat = index, array, stat
+        return self._index, self._array
+
+    def _write(self, index, array=None):
+        if array is not None:
+            index['generation'] += 1
+            stale = index.get('previous')
+            index['previous'] = index.get('data')
+            index['data'] = 'data-{}.bin'.format(index['generation'])
+            index['days'] = array.shape[0]
+            tmp = self.path / (index['data'] + '.tmp')
+            np.ascontiguousarray(array, dtype=np.int32).tofile(str(tmp))
+            os.replace(str(tmp), str(self.path / index['data']))
+
+        tmp = self.path / 'index.json.tmp'
+        with open(str(tmp), 'w') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(str(tmp), str(self._index_path))
+
+        if array is not None and stale is not None:
+            try:
+                os.remove(str(self.path / stale))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _write_lock(self):
+        with open(str(self._lock_path), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def create(self):
+        if self._index_path.exists():
+            return False
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._write_lock():
+            self._write({'generation': 0, 'data': None, 'day0': None,
+                         'days': 0, 'fields': list(self.FIELDS),
+                         'cities': dict(), 'meta': dict()})
+        return True
+
+    def get_meta(self):
+        index, _ = self._load()
+        return dict(index['meta'])
+
+    def update_meta(self, **values):
+        with self._write_lock():
+            index, _ = self._load()
+            index = dict(index, meta=dict(index['meta'], **values))
+            self._write(index)
+
+    def get_city(self, city):
+        index, _ = self._load()
+        if city not in index['cities']:
+            return None
+        return self._city(city, index['cities'][city])
+
+    @staticmethod
+    def _city(city, item):
+        return {'id': city, 'name': item['name'], 'from_': item['from_'],
+                'to_': item['to_'], 'versions': item.get('versions', []),
+                'hash': item.get('hash'), 'version': item.get('version', 0)}
+
+    def scan_cities(self):
+        index, _ = self._load()
+        for city, item in index['cities'].items():
+            yield self._city(city, item)
+
+    def get_data(self, city):
+        index, array = self._load()
+        if city not in index['cities'] or array is None:
+            return dict()
+
+        with profiling.timer('mmap_read'):
+            column = array[:, index['cities'][city]['column'], :]
+            days = np.flatnonzero(column[:, 0] != self.MISSING)
+            values = column[days].tolist()
+
+        fields = index['fields']
+        data = dict()
+        for key, (day, row) in enumerate(zip(days.tolist(), values)):
+            record = {'date': datetime.fromordinal(
+                index['day0'] + day).strftime('%d.%m.%Y')}
+            record.update(zip(fields, row))
+            data[key] = record
+        return data
+
+    def _store(self, city, data, name=None, versions=None, version=None):
+        if not data:
+            raise ValueError('empty data for {}'.format(city))
+        records = [data[key] for key in sorted(data)]
+        days = [datetime.strptime(record['date'], '%d.%m.%Y').toordinal()
+                for record in records]
+
+        with self._write_lock():
+            index, array = self._load()
+            index = json.loads(json.dumps(index))
+            cities = index['cities']
+            if city not in cities:
+                cities[city] = {'column': len(cities), 'name': name}
+            elif name is not None:
+                cities[city]['name'] = name
+            cities[city]['from_'] = records[0]['date']
+            cities[city]['to_'] = records[-1]['date']
+            cities[city]['hash'] = content_hash(data)
+            if version is None:
+                version = cities[city].get('version', 0) + 1
+            cities[city]['version'] = version
+            if versions is not None:
+                cities[city]['versions'] = versions
+
+            day0 = min(days + ([index['day0']] if array is not None else []))
+            last = max(days + ([index['day0'] + index['days'] - 1]
+                               if array is not None else []))
+            new = np.full((last - day0 + 1, len(cities), len(self.FIELDS)),
+                          self.MISSING, dtype=np.int32)
+            if array is not None:
+                offset = index['day0'] - day0
+                new[offset:offset + array.shape[0], :array.shape[1]] = array
+            column = cities[city]['column']
+            new[:, column] = self.MISSING
+            for day, record in zip(days, records):
+                new[day - day0, column] = [record[field]
+                                           for field in self.FIELDS]
+            index['day0'] = day0
+            self._write(index, new)
+        return version
+
+    def put_city(self, city, name, data, versions=None, version=1):
+        self._store(city, data, name, versions or [], version)
+
+    def update_data(self, city, data, versions=None):
+        return self._store(city, data, versions=versions)
+
+
+def copy(source, target):
+    r"""
+    Копирует все города и метаданные из хранилища source в target.
+
+    :type source: Storage
+    :type target: Storage
+    """
+    target.create()
+    for item in source.scan_cities():
+        target.put_city(item['id'], item['name'],
+                        source.get_data(item['id']), item['versions'],
+                        max(item['version'], 1))
+    target.update_meta(**{key: value for key, value
+                          in source.get_meta().items() if key != 'id'})
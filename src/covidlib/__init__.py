@@ -1,3 +1,8 @@
-__version__ = '0.1.0'
+__version__ = '0.1.1'
 
 from .approximator import NesterovConstantGamma, Nesterov
+from .features import FeatureFrame
+from .registry import ModelRegistry
+from . import admission
+from . import cancellation
+from . import profiling
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from . import cancellation
+from . import profiling
+
+profiling.describe('covid_admission_active', 'gauge',
+                   'Admitted jobs that are running now')
+profiling.describe('covid_admission_queue_depth', 'gauge',
+                   'Jobs waiting for admission')
+profiling.describe('covid_admission_wait_seconds', 'summary',
+                   'Time spent waiting for admission by priority')
+profiling.describe('covid_admission_rejected_total', 'counter',
+                   'Jobs rejected because the queue was full')
+
+# как часто ожидающие задачи проверяют признак отмены
+_POLL_INTERVAL = 0.5
+
+
+class Overloaded(Exception):
+    r"""
+    Очередь заполнена, задача не принята.
+
+    :param retry_after: через сколько секунд имеет смысл повторить запрос
+    :type retry_after: int
+    """
+
+    def __init__(self, retry_after):
+        super(Overloaded, self).__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class _Entry(object):
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.rejected = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionQueue(object):
+    r"""
+    Ограничивает количество одновременно выполняемых тяжелых задач.
+
+    Одновременно выполняется не больше slots задач, остальные ждут
+    в очереди длины не больше max_queue. Из очереди первой берется задача
+    с меньшим priority (при равных -- пришедшая раньше). Если очередь
+    заполнена, новая задача вытесняет из очереди последнюю задачу с большим
+    priority, а если такой нет -- отклоняется с :class:`Overloaded`.
+    Ожидающая задача проверяет признак отмены текущего потока
+    (см. :mod:`covidlib.cancellation`) и при отмене покидает очередь.
+
+    :param slots: количество одновременно выполняемых задач
+    :type slots: int
+
+    :param max_queue: максимальная длина очереди
+    :type max_queue: int
+    """
+
+    def __init__(self, slots=1, max_queue=16):
+        self.slots = max(1, slots)
+        self.max_queue = max(0, max_queue)
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        # среднее время выполнения задачи, для Retry-After
+        self._duration = None
+
+    def retry_after(self):
+        r"""
+        Оценка времени (в секундах), через которое очередь освободится.
+
+        :rtype: int
+        """
+        duration = self._duration or 1.
+        return max(1, int(math.ceil(
+            duration * (len(self._waiting) + 1) / self.slots)))
+
+    def _update_gauges(self):
+        profiling.set_gauge('covid_admission_active', self._active)
+        profiling.set_gauge('covid_admission_queue_depth',
+                            len(self._waiting))
+
+    def _reject(self):
+        profiling.inc('covid_admission_rejected_total')
+        return Overloaded(self.retry_after())
+
+    def _enqueue(self, priority):
+        entry = _Entry(priority, next(self._seq))
+        if len(self._waiting) >= self.max_queue:
+            worst = max(self._waiting) if self._waiting else None
+            if worst is None or not priority < worst.priority:
+                raise self._reject()
+            worst.rejected = True
+            self._waiting.remove(worst)
+            heapq.heapify(self._waiting)
+            self._cond.notify_all()
+        heapq.heappush(self._waiting, entry)
+        return entry
+
+    def _leave(self, entry):
+        if entry in self._waiting:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority=0, label=None):
+        r"""
+        Контекстный менеджер, внутри которого выполняется задача.
+        Ждет своей очереди либо бросает :class:`Overloaded`.
+
+        :param priority: приоритет задачи (меньше -- раньше)
+        :type priority: int
+
+        :param label: значение метки priority в метрике времени ожидания
+            (по умолчанию priority)
+        :type label: str
+        """
+        start = time.monotonic()
+        with self._cond:
+            if self._active < self.slots and not self._waiting:
+                self._active += 1
+            else:
+                entry = self._enqueue(priority)
+                self._update_gauges()
+                try:
+                    while not entry.rejected and not (
+                            self._waiting[0] is entry
+                            and self._active < self.slots):
+                        self._cond.wait(_POLL_INTERVAL)
+                        cancellation.check()
+                except BaseException:
+                    self._leave(entry)
+                    self._update_gauges()
+                    raise
+                if entry.rejected:
+                    self._update_gauges()
+                    raise self._reject()
+                heapq.heappop(self._waiting)
+                self._active += 1
+                self._cond.notify_all()
+            self._update_gauges()
+
+        profiling.observe('covid_admission_wait_seconds',
+                          time.monotonic() - start,
+                          priority=str(priority if label is None else label))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started
+            with self._cond:
+                self._active -= 1
+                self._duration = duration if self._duration is None else (
+                    0.8 * self._duration + 0.2 * duration)
+                self._update_gauges()
+                self._cond.notify_all()
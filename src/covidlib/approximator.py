@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 from abc import ABC
-from scipy.interpolate import interp1d
 import datetime
+import importlib
+import multiprocessing
 import numpy as np
-import pandas as pd
-from sklearn.linear_model import Ridge
-from statsmodels.tsa.arima.model import ARIMA
+
+from . import cancellation
+from . import profiling
+from .features import to_frame
+
+# как часто проверяется признак отмены при вычислении в дочерних процессах
+_POLL_INTERVAL = 0.1
 
 
 class Approximator(ABC):
@@ -27,11 +32,13 @@ class Approximator(ABC):
                                'sick': int,
                                'recovered': int,
                                'died': int}
+            либо уже построенные по нему признаки
+            (:class:`covidlib.features.FeatureFrame`)
         :type data: dict
         """
         raise NotImplementedError
 
-    def predict(self, date):
+    def predict(self, date, fields=None):
         r"""
         Данная функция должна возвращать предсказания для данной даты.
         Предсказывать нужно количество заболевших, выздоровших и умерших.
@@ -39,6 +46,9 @@ class Approximator(ABC):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         :return: Словарь вида {'date': строка в формате day.month.year,
                                'sick': int,
                                'recovered': int,
@@ -48,7 +58,7 @@ class Approximator(ABC):
         """
         raise NotImplementedError
 
-    def predict_between(self, date_from, date_to):
+    def predict_between(self, date_from, date_to, fields=None):
         r"""
         Данная функция должна возвращать предсказания для всех дат между
             адаными.
@@ -57,6 +67,9 @@ class Approximator(ABC):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         :return: список словарей вида:
         {
             'date': строка в формате day.month.year,
@@ -68,10 +81,519 @@ class Approximator(ABC):
         """
         raise NotImplementedError
 
+    def predict_interval(self, date_from, date_to, fields=None,
+                         quantiles=(0.05, 0.5, 0.95), samples=1000, seed=0):
+        r"""
+        Данная функция должна возвращать интервальный прогноз для всех дат
+            между заданными: квантили распределения предсказаний,
+            оцененного методом Монте-Карло по samples траекториям.
+
+        :param date_from: Строка формата "day.month.year"
+        :type date_from: str
+
+        :param date_to: Строка формата "day.month.year"
+        :type date_to: str
+
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
+        :param quantiles: уровни квантилей от 0 до 1
+        :type quantiles: list
+
+        :param samples: количество траекторий
+        :type samples: int
+
+        :param seed: начальное значение генератора случайных чисел
+            (одинаковые запросы дают одинаковые интервалы)
+        :type seed: int
+
+        :return: список словарей вида:
+        {
+            'date': строка в формате day.month.year,
+            'sick': {уровень квантиля: int},
+            'recovered': {уровень квантиля: int},
+            'died': {уровень квантиля: int}
+        }
+        :rtype: list
+        """
+        raise NotImplementedError
+
+    def get_parameters(self):
+        r"""
+        Возвращает нормализованные параметры модели (после приведения типов
+        и ограничения диапазонов в конструкторе).
+
+        :return: словарь вида {имя параметра: значение}
+        :rtype: dict
+        """
+        return {key: getattr(self, key) for key in self._parameters}
+
+    def get_state(self):
+        r"""
+        Возвращает компактное состояние обученной модели, которое можно
+        сериализовать в JSON. Данные выборки целиком не сохраняются, только
+        то, что нужно для предсказания.
+
+        :return: словарь состояния модели
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+    def set_state(self, state):
+        r"""
+        Восстанавливает обученную модель из состояния, полученного через
+        :meth:`get_state`. После вызова модель готова к предсказанию без
+        повторного вызова :meth:`fit`.
+
+        :param state: словарь состояния модели
+        :type state: dict
+        """
+        raise NotImplementedError
+
+
+def _start_worker(preload):
+    r"""Подготавливает дочерний процесс :func:`_map`."""
+    cancellation.reset()
+    for module in preload:
+        importlib.import_module(module)
+
+
+def _map(function, arguments, n_jobs=1, preload=()):
+    r"""
+    Применяет function к каждому элементу arguments. При n_jobs > 1
+    вычисления выполняются в n_jobs процессах, результат совпадает
+    с последовательным вычислением (включая порядок).
+    function должна быть определена на уровне модуля, чтобы ее можно было
+    передать в дочерний процесс.
+
+    Перед каждым вычислением проверяется признак отмены текущего потока
+    (см. :mod:`covidlib.cancellation`). Если признак требует изоляции,
+    вычисления выполняются в дочерних процессах даже при n_jobs = 1:
+    при отмене процессы завершаются, не дожидаясь окончания обучения.
+
+    Дочерние процессы запускаются через spawn, а не fork: в сервере
+    к этому моменту уже работают другие потоки (потоки запросов, запись
+    журнала), и fork мог скопировать блокировку, захваченную одним из
+    них, так что дочерний процесс зависал бы на ней. Зато каждый
+    процесс заново импортирует numpy, covidlib и модули preload (их он
+    импортирует сразу при запуске) -- около секунды на запуск пула,
+    поэтому параллельное обучение окупается только на долгих моделях.
+    """
+    cancellation.check()
+    token = cancellation.current()
+    isolate = token is not None and token.isolate
+    if not isolate and (n_jobs is None or n_jobs <= 1 or len(arguments) <= 1):
+        result = []
+        for argument in arguments:
+            cancellation.check()
+            result.append(function(argument))
+        return result
+
+    processes = max(1, min(n_jobs or 1, len(arguments)))
+    with multiprocessing.get_context('spawn').Pool(
+            processes, initializer=_start_worker,
+            initargs=(tuple(preload),)) as pool:
+        result = pool.map_async(function, arguments)
+        while not result.ready():
+            if token is not None and token.reason() is not None:
+                # выход из with завершает дочерние процессы
+                token.check()
+            result.wait(_POLL_INTERVAL)
+        return result.get()
+
+
+# scipy, sklearn, pandas и statsmodels импортируются при первом
+# использовании: описание моделей (_name, _parameters) и реестр доступны
+# без них, а запуск сервиса и скриптов не ждет импорта всех библиотек
+
+
+def _fit_spline(arguments):
+    from scipy.interpolate import interp1d
+
+    x, y, kind = arguments
+    return interp1d(x, y, kind=kind, fill_value="extrapolate")
+
+
+def _fit_ridge(arguments):
+    from sklearn.linear_model import Ridge
+
+    x, y, alpha = arguments
+    return Ridge(alpha).fit(x, y)
+
+
+def _select(pred, fields):
+    r"""Оставляет в предсказании только дату и поля fields."""
+    if fields is None:
+        return pred
+    return {key: pred[key] for key in pred if key == 'date' or key in fields}
+
+
+def _to_builtin(value):
+    r"""Приводит numpy скаляры к встроенным типам python для JSON."""
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _dump_table(table):
+    r"""
+    Сериализует словарь вида {datetime.date: {поле: значение}} в
+    поколоночный словарь.
+    """
+    dates = sorted(table)
+    columns = sorted({column for date in dates for column in table[date]})
+    return {'date': [date.strftime('%d.%m.%Y') for date in dates],
+            'columns': {column: [_to_builtin(table[date].get(column))
+                                 for date in dates]
+                        for column in columns}}
+
+
+def _load_table(state):
+    r"""Обратная операция к :func:`_dump_table`."""
+    table = dict()
+    for i, date in enumerate(state['date']):
+        date = datetime.datetime.strptime(date, '%d.%m.%Y').date()
+        table[date] = dict()
+        for column in state['columns']:
+            value = state['columns'][column][i]
+            if value is not None:
+                table[date][column] = value
+    return table
+
+
+def _cumulative_columns(data, fill='linear'):
+    r"""
+    Строит по выборке столбцы на непрерывной сетке дней
+    (см. :meth:`covidlib.features.FeatureFrame.grid`): new sick, new died,
+    new reco, накопленное число заболевших sick и число болеющих S:
+
+        T(d) = T(d - 1) + C(d)
+
+        S(d) = S(d - 1) + C(d) - D(d) - R(d)
+
+    :param data: выборка в формате :meth:`Approximator.fit`
+    :type data: dict
+
+    :return: список дат сетки и словарь столбцов (массивов)
+    :rtype: tuple
+    """
+    dates, columns = to_frame(data).grid(fill)
+    return dates, {name: columns[name] for name in
+                   ('new sick', 'new died', 'new reco', 'sick', 'S')}
+
+
+def _table(dates, columns):
+    r"""
+    Переводит столбцы в таблицу {дата: {поле: значение}}. Значения
+    столбцов приводятся к встроенным типам.
+
+    :rtype: dict
+    """
+    columns = {name: np.asarray(columns[name]).tolist() for name in columns}
+    return {date: {name: columns[name][i] for name in columns}
+            for i, date in enumerate(dates)}
+
+
+_FILL_PARAMETER = {
+    'description': 'Заполнение пропущенных дней: линейная интерполяция'
+                   ' либо нули.',
+    'type': 'choise',
+    'values': ['linear', 'zero'],
+    'default': 'linear',
+    'min': None,
+    'max': None}
+
+
+def _last_date(state, table):
+    r"""
+    Возвращает последний день выборки из состояния модели (в состояниях,
+    сохраненных до появления поля last_date, -- последний день таблицы).
+    """
+    if 'last_date' in state:
+        return datetime.datetime.strptime(state['last_date'],
+                                          '%d.%m.%Y').date()
+    return max(table)
+
+
+def _normal_root(cov):
+    r"""
+    Возвращает матрицу A, такую что A A^T = cov. Ковариация может быть
+    вырожденной, поэтому используется спектральное разложение.
+    """
+    values, vectors = np.linalg.eigh(np.atleast_2d(cov))
+    return vectors * np.sqrt(np.clip(values, 0, None))
+
+
+def _simulate_arima(result, steps, samples, rng):
+    r"""
+    Выбирает samples траекторий модели ARIMA на steps дней после конца
+    ее выборки. Все траектории считаются одновременно в пространстве
+    состояний модели: начальное состояние выбирается из распределения
+    прогноза фильтра Калмана, на каждом шаге добавляются шумы наблюдения
+    и состояния. Среднее траекторий -- точечный прогноз модели.
+
+    :param result: обученная модель statsmodels
+    :param rng: генератор случайных чисел
+    :type rng: numpy.random.Generator
+
+    :return: массив размера (samples, steps)
+    :rtype: numpy.ndarray
+    """
+    ssm = result.filter_results
+    design = ssm.design[..., -1]
+    obs_intercept = ssm.obs_intercept[:, -1]
+    obs_root = _normal_root(ssm.obs_cov[..., -1])
+    transition = ssm.transition[..., -1]
+    state_intercept = ssm.state_intercept[:, -1]
+    state_root = ssm.selection[..., -1].dot(
+        _normal_root(ssm.state_cov[..., -1]))
+
+    state = (ssm.predicted_state[:, -1]
+             + rng.standard_normal((samples, len(state_intercept))).dot(
+                 _normal_root(ssm.predicted_state_cov[..., -1]).T))
+    paths = np.empty((samples, steps))
+    for step in range(steps):
+        paths[:, step] = (state.dot(design.T) + obs_intercept
+                          + rng.standard_normal(
+                              (samples, obs_root.shape[1])).dot(obs_root.T)
+                          )[:, 0]
+        state = (state.dot(transition.T) + state_intercept
+                 + rng.standard_normal(
+                     (samples, state_root.shape[1])).dot(state_root.T))
+    return paths
+
+
+def _fit_ar(endog, order, diff=0, alpha=0.1, default=0.0):
+    r"""
+    Оценивает авторегрессию порядка order со свободным членом по ряду
+    endog (после diff взятий разностей) гребневой регрессией в замкнутом
+    виде: матрица лагов строится без копирования, коэффициенты -- решение
+    системы order x order. Сила регуляризации alpha задается
+    относительно средней дисперсии лагов, поэтому не зависит от масштаба
+    ряда. Свободный член не регуляризуется.
+
+    :param endog: значения ряда по порядку
+    :type endog: list
+
+    :param default: значение ряда, если он пуст
+    :type default: float
+
+    :return: модель -- словарь {'order', 'diff', 'params' (свободный член
+        и коэффициенты при лагах 1..order), 'mean' (среднее ряда после
+        взятия разностей), 'sigma' (стандартное отклонение остатков),
+        'tail' (последние значения ряда, нужные для прогноза)}
+    :rtype: dict
+    """
+    levels = np.asarray(endog, dtype=float)
+    if not len(levels):
+        levels = np.array([default])
+    series = np.diff(levels, n=diff) if len(levels) > diff else np.zeros(1)
+
+    params = np.zeros(order + 1)
+    sigma = 0.0
+    if len(series) > order + 1:
+        # строка i -- значения series[i + order - 1], ..., series[i]
+        lags = np.lib.stride_tricks.sliding_window_view(
+            series, order)[:-1, ::-1]
+        target = series[order:]
+        lags_mean = lags.mean(axis=0)
+        target_mean = target.mean()
+        centered = lags - lags_mean
+        gram = centered.T.dot(centered)
+        penalty = alpha * max(np.trace(gram) / order, 1e-300)
+        coef = np.linalg.solve(gram + penalty * np.eye(order),
+                               centered.T.dot(target - target_mean))
+        params = np.concatenate(([target_mean - lags_mean.dot(coef)], coef))
+        sigma = float(np.std(target - lags.dot(coef) - params[0]))
+    else:
+        params[0] = series.mean()
+
+    tail = levels[-(order + diff):].tolist()
+    return {'order': order, 'diff': diff, 'params': params.tolist(),
+            'mean': float(series.mean()), 'sigma': sigma, 'tail': tail}
+
+
+def _ar_series(ar, history):
+    r"""
+    Переводит последние значения ряда в лаги модели :func:`_fit_ar`
+    (разности при diff > 0). Недостающие лаги заполняются средним ряда.
+
+    :return: пара (лаги от последнего к первому, последнее значение ряда)
+    :rtype: tuple
+    """
+    history = np.asarray(history, dtype=float)
+    last = history[-1] if len(history) else ar['mean']
+    series = np.diff(history, n=ar['diff']) if ar['diff'] else history
+    lags = np.full(ar['order'], ar['mean'])
+    series = series[::-1][:ar['order']]
+    lags[:len(series)] = series
+    return lags, last
+
+
+def _predict_ar(ar, history):
+    r"""
+    Прогноз модели :func:`_fit_ar` на один шаг после значений history.
+
+    :rtype: float
+    """
+    lags, last = _ar_series(ar, history)
+    step = ar['params'][0] + np.dot(ar['params'][1:], lags)
+    return float(last + step if ar['diff'] else step)
+
+
+def _simulate_ar(ar, steps, samples=1, rng=None):
+    r"""
+    Выбирает samples траекторий модели :func:`_fit_ar` на steps шагов
+    после конца ее выборки; все траектории считаются одновременно.
+    Без rng шумы не добавляются, и траектория -- точечный прогноз.
+
+    :param rng: генератор случайных чисел
+    :type rng: numpy.random.Generator
+
+    :return: массив размера (samples, steps)
+    :rtype: numpy.ndarray
+    """
+    lags, last = _ar_series(ar, ar['tail'])
+    intercept, coef = ar['params'][0], np.asarray(ar['params'][1:])
+    lags = np.tile(lags, (samples, 1))
+    last = np.full(samples, last)
+    paths = np.empty((samples, steps))
+    for step in range(steps):
+        value = intercept + lags.dot(coef)
+        if rng is not None:
+            value = value + rng.normal(0.0, ar['sigma'], samples)
+        lags = np.column_stack((value, lags[:, :-1]))
+        if ar['diff']:
+            last = last + value
+            value = last
+        paths[:, step] = value
+    return paths
+
+
+def _propagate(sick, S, gamma, k, l_coef):
+    r"""
+    Прогоняет рекуррентные соотношения модели Нестерова одновременно
+    для всех траекторий (цикл только по дням):
+
+        C(d) = gamma(d - \delta) * (T(d - 1) - T(d - \delta - 1))
+
+        D(d) = k(d) * S(d - 1), R(d) = l(d) * S(d - 1)
+
+    Значения, как и в точечном прогнозе, округляются к нулю.
+
+    :param sick: T за последние \delta + 1 дней выборки
+    :type sick: numpy.ndarray
+
+    :param S: S последнего дня выборки
+    :type S: int
+
+    :param gamma: массив (траектории, дни) значений gamma(d - \delta)
+        для дней прогноза d
+    :type gamma: numpy.ndarray
+
+    :param k: массив (траектории, дни) значений k(d)
+    :type k: numpy.ndarray
+
+    :param l_coef: массив (траектории, дни) значений l(d)
+    :type l_coef: numpy.ndarray
+
+    :return: словарь массивов (траектории, дни) new sick, new died, new reco
+    :rtype: dict
+    """
+    samples, days = np.shape(gamma)
+    delta = len(sick) - 1
+    total = np.empty((samples, delta + 1 + days))
+    total[:, :delta + 1] = sick
+    S = np.full(samples, float(S))
+    columns = {name: np.empty((samples, days))
+               for name in ('new sick', 'new died', 'new reco')}
+    for day in range(days):
+        cancellation.check()
+        index = delta + 1 + day
+        new_sick = np.trunc(gamma[:, day] * (total[:, index - 1]
+                                             - total[:, index - delta - 1]))
+        new_died = np.trunc(k[:, day] * S)
+        new_reco = np.trunc(l_coef[:, day] * S)
+        S = S + new_sick - new_died - new_reco
+        total[:, index] = total[:, index - 1] + new_sick
+        columns['new sick'][:, day] = new_sick
+        columns['new died'][:, day] = new_died
+        columns['new reco'][:, day] = new_reco
+    return columns
+
+
+# наибольшее число людей в траектории интервального прогноза
+_MAX_COUNT = float(2 ** 53)
+
+
+def _counts(values):
+    r"""
+    Приводит значения траекторий к возможным числам людей за день:
+    отрицательные значения (их дают хвосты распределений параметров,
+    а k и l -- еще и отрицательное число болеющих S, которое считается
+    от начала выборки) заменяются нулем, а разошедшиеся траектории
+    (бесконечность и NaN) -- значением _MAX_COUNT.
+
+    :type values: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    values = np.nan_to_num(values, nan=_MAX_COUNT, posinf=_MAX_COUNT,
+                           neginf=0.0)
+    return np.clip(values, 0.0, _MAX_COUNT)
+
+
+def _nesterov_interval(model, date_from, date_to, parameters, outputs,
+                       fields, quantiles):
+    r"""
+    Общая часть интервального прогноза моделей Нестерова. Рекуррентные
+    соотношения считаются так же, как в точечном прогнозе, а перед
+    вычислением квантилей число новых заболевших, умерших и выздоровевших
+    в траекториях ограничивается снизу нулем (см. :func:`_counts`),
+    поэтому границы интервала не бывают отрицательными, даже если
+    точечный прогноз отрицателен.
+
+    :param model: обученная модель с таблицей dict_of_data, последним днем
+        выборки last_date и параметром delta
+    :param parameters: функция, которая по числу дней прогноза возвращает
+        массивы (траектории, дни) gamma(d - \delta), k(d) и l(d)
+    :param outputs: соответствие полей прогноза и столбцов таблицы
+
+    :rtype: list
+    """
+    date_from = datetime.datetime.strptime(date_from, '%d.%m.%Y').date()
+    date_to = datetime.datetime.strptime(date_to, '%d.%m.%Y').date()
+    table, last = model.dict_of_data, model.last_date
+
+    days = max((date_to - last).days, 0)
+    sick = np.array([table.get(last - datetime.timedelta(days=shift),
+                               {'sick': 0})['sick']
+                     for shift in range(model.delta, -1, -1)])
+    columns = _propagate(sick, table[last]['S'], *parameters(days))
+
+    levels = ['{:g}'.format(level) for level in quantiles]
+    bands = {name: np.rint(np.quantile(_counts(columns[name]), quantiles,
+                                       axis=0)).astype(np.int64).T.tolist()
+             for name in columns}
+
+    records = []
+    cur_date = date_from
+    while cur_date <= date_to:
+        record = {'date': cur_date.strftime('%d.%m.%Y')}
+        for field, name in outputs.items():
+            if cur_date <= last:
+                values = [table[cur_date][name]] * len(levels)
+            else:
+                values = bands[name][(cur_date - last).days - 1]
+            record[field] = dict(zip(levels, values))
+        records.append(_select(record, fields))
+        cur_date = cur_date + datetime.timedelta(days=1)
+    return records
+
 
 class SplineApproximator(Approximator):
     r"""
     Простая реализация аппроксиматора на основе сплайнов.
+    При n_jobs > 1 сплайны для разных полей строятся параллельно.
     """
     _name = 'Сплайны'
     _parameters = {'kind': {
@@ -83,12 +605,14 @@ class SplineApproximator(Approximator):
         'min': None,
         'max': None}}
 
-    def __init__(self, kind='cubic'):
+    def __init__(self, kind='cubic', n_jobs=1):
         super(SplineApproximator, self).__init__()
 
         self.kind = kind
+        self.n_jobs = int(n_jobs)
         self.approximators = dict()
 
+    @profiling.timed_method('fit')
     def fit(self, data):
         r"""
         Данная функция должна аппроксимировать выборку для полученных данных.
@@ -105,33 +629,63 @@ class SplineApproximator(Approximator):
         """
         models = ['sick', 'recovered', 'died']
 
-        points = sorted(list(data.keys()))
-        for model in models:
-            y = [data[p][model] for p in points]
-            x = [datetime.datetime.strptime(data[p]['date'],
-                                            '%d.%m.%Y').timestamp() for p in
-                 points]
-            self.approximators[model] = interp1d(x, y, kind=self.kind,
-                                                 fill_value="extrapolate")
+        frame = to_frame(data)
+        x = frame.timestamps().tolist()
+        approximators = _map(
+            _fit_spline,
+            [(x, frame.observed(model), self.kind) for model in models],
+            self.n_jobs, preload=('scipy.interpolate',))
+        for model, approximator in zip(models, approximators):
+            self.approximators[model] = approximator
+
+    def get_state(self):
+        r"""
+        Возвращает компактное состояние обученной модели: узлы сплайнов.
+
+        :rtype: dict
+        """
+        return {model: {'x': self.approximators[model].x.tolist(),
+                        'y': self.approximators[model].y.tolist()}
+                for model in self.approximators}
+
+    def set_state(self, state):
+        r"""
+        Восстанавливает сплайны по узлам из :meth:`get_state`.
+
+        :param state: словарь состояния модели
+        :type state: dict
+        """
+        from scipy.interpolate import interp1d
+
+        self.approximators = dict()
+        for model in state:
+            self.approximators[model] = interp1d(
+                state[model]['x'], state[model]['y'], kind=self.kind,
+                fill_value="extrapolate")
 
-    def predict(self, date):
+    def predict(self, date, fields=None):
         r"""
         Данная функция должна возвращать предсказания для данной даты.
         Предсказывать нужно количество заболевших, выздоровших и умерших.
 
         :param date: Строка формата "day.month.year"
         :type date: str
+
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
         """
         pred_date = datetime.datetime.strptime(date, '%d.%m.%Y').timestamp()
 
         ret = dict()
         ret['date'] = date
         for key in self.approximators:
-            ret[key] = self.approximators[key](pred_date).tolist()
+            if fields is None or key in fields:
+                ret[key] = self.approximators[key](pred_date).tolist()
 
         return ret
 
-    def predict_between(self, date_from, date_to):
+    @profiling.timed_method('predict_between')
+    def predict_between(self, date_from, date_to, fields=None):
         r"""
         Данная функция должна возвращать предсказания для всех дат между
             адаными.
@@ -140,6 +694,9 @@ class SplineApproximator(Approximator):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         :return: список словарей вида:
         {
             'date': строка в формате day.month.year,
@@ -156,7 +713,8 @@ class SplineApproximator(Approximator):
 
         list_of_ret = []
         while cur_date <= date_to:
-            pred = self.predict(cur_date.strftime('%d.%m.%Y'))
+            cancellation.check()
+            pred = self.predict(cur_date.strftime('%d.%m.%Y'), fields)
             cur_date = cur_date + datetime.timedelta(days=1)
 
             list_of_ret.append(pred)
@@ -167,6 +725,7 @@ class SplineApproximator(Approximator):
 class LinearApproximator(Approximator):
     r"""
     Простая реализация аппроксиматора на основе линейной регрессии.
+    При n_jobs > 1 регрессии для разных полей обучаются параллельно.
     """
     _name = 'МНК'
     _parameters = {'alpha': {
@@ -178,9 +737,11 @@ class LinearApproximator(Approximator):
         'min': '0.0',
         'max': '1000.0'}}
 
-    def __init__(self, alpha=1.0):
+    def __init__(self, alpha=1.0, n_jobs=1):
         super(LinearApproximator, self).__init__()
 
+        self.n_jobs = int(n_jobs)
+
         self.alpha = float(alpha)
         if self.alpha < float(self._parameters['alpha']['min']):
             self.alpha = float(self._parameters['alpha']['min'])
@@ -188,6 +749,7 @@ class LinearApproximator(Approximator):
             self.alpha = float(self._parameters['alpha']['max'])
         self.approximators = dict()
 
+    @profiling.timed_method('fit')
     def fit(self, data):
         r"""
         Данная функция должна аппроксимировать выборку для полученных данных.
@@ -204,34 +766,68 @@ class LinearApproximator(Approximator):
         """
         models = ['sick', 'recovered', 'died']
 
-        points = sorted(list(data.keys()))
-        for model in models:
-            y = [data[p][model] for p in points]
-            x = np.array(
-                [datetime.datetime.strptime(data[p]['date'], '%d.%m.%Y'
-                                            ).timestamp() for p in points]
-            ).reshape([-1, 1])
-            self.approximators[model] = Ridge(self.alpha)
-            self.approximators[model].fit(np.reshape(x, [-1, 1]), y)
+        frame = to_frame(data)
+        x = np.array(frame.timestamps()).reshape([-1, 1])
+        approximators = _map(
+            _fit_ridge,
+            [(x, frame.observed(model), self.alpha) for model in models],
+            self.n_jobs, preload=('sklearn.linear_model',))
+        for model, approximator in zip(models, approximators):
+            self.approximators[model] = approximator
 
-    def predict(self, date):
+    def get_state(self):
+        r"""
+        Возвращает компактное состояние обученной модели: коэффициенты
+        регрессии.
+
+        :rtype: dict
+        """
+        return {model: {'coef': self.approximators[model].coef_.tolist(),
+                        'intercept': _to_builtin(
+                            self.approximators[model].intercept_)}
+                for model in self.approximators}
+
+    def set_state(self, state):
+        r"""
+        Восстанавливает регрессии по коэффициентам из :meth:`get_state`.
+
+        :param state: словарь состояния модели
+        :type state: dict
+        """
+        from sklearn.linear_model import Ridge
+
+        self.approximators = dict()
+        for model in state:
+            regression = Ridge(self.alpha)
+            regression.coef_ = np.array(state[model]['coef'])
+            regression.intercept_ = state[model]['intercept']
+            regression.n_features_in_ = regression.coef_.shape[0]
+            self.approximators[model] = regression
+
+    def predict(self, date, fields=None):
         r"""
         Данная функция должна возвращать предсказания для данной даты.
         Предсказывать нужно количество заболевших, выздоровших и умерших.
 
         :param date: Строка формата "day.month.year"
         :type date: str
+
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
         """
         pred_date = datetime.datetime.strptime(date, '%d.%m.%Y').timestamp()
 
         ret = dict()
         ret['date'] = date
         for key in self.approximators:
-            ret[key] = self.approximators[key].predict([[pred_date]]).tolist()
+            if fields is None or key in fields:
+                ret[key] = self.approximators[key].predict(
+                    [[pred_date]]).tolist()
 
         return ret
 
-    def predict_between(self, date_from, date_to):
+    @profiling.timed_method('predict_between')
+    def predict_between(self, date_from, date_to, fields=None):
         r"""
         Данная функция должна возвращать предсказания для всех дат между
             адаными.
@@ -240,6 +836,9 @@ class LinearApproximator(Approximator):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         :return: список словарей вида:
         {
             'date': строка в формате day.month.year,
@@ -256,7 +855,8 @@ class LinearApproximator(Approximator):
 
         list_of_ret = []
         while cur_date <= date_to:
-            pred = self.predict(cur_date.strftime('%d.%m.%Y'))
+            cancellation.check()
+            pred = self.predict(cur_date.strftime('%d.%m.%Y'), fields)
             cur_date = cur_date + datetime.timedelta(days=1)
 
             list_of_ret.append(pred)
@@ -301,9 +901,10 @@ class NesterovConstantGamma(Approximator):
             'values': [],
             'default': '14',
             'min': '1',
-            'max': '30'}}
+            'max': '30'},
+        'fill': _FILL_PARAMETER}
 
-    def __init__(self, gamma=1.0, k=0.0007, l=0.03, delta=10):
+    def __init__(self, gamma=1.0, k=0.0007, l=0.03, delta=10, fill='linear'):
         super(NesterovConstantGamma, self).__init__()
 
         self.gamma = float(gamma)
@@ -330,11 +931,16 @@ class NesterovConstantGamma(Approximator):
         if self.delta > int(self._parameters['delta']['max']):
             self.delta = int(self._parameters['delta']['max'])
 
+        self.fill = fill
+        if self.fill not in self._parameters['fill']['values']:
+            self.fill = self._parameters['fill']['default']
+
+    @profiling.timed_method('fit')
     def fit(self, data):
         r"""
         Данная функция должна аппроксимировать выборку для полученных данных.
         Под аппроксимацией подрозумевается настройка всех параметров модели.
-        Предполагается, что все дни представлены в выборки.
+        Пропущенные дни заполняются согласно параметру fill.
 
         :param data: Словарь вида
                 key - номер объекта,
@@ -344,30 +950,8 @@ class NesterovConstantGamma(Approximator):
                                'died': int}
         :type data: dict
         """
-
-        self.dict_of_data = dict()
-
-        for key in data:
-            date = datetime.datetime.strptime(data[key]['date'],
-                                              '%d.%m.%Y').date()
-            if date not in self.dict_of_data:
-                self.dict_of_data[date] = dict()
-            self.dict_of_data[date]['new sick'] = data[key]['sick']
-            self.dict_of_data[date]['new died'] = data[key]['died']
-            self.dict_of_data[date]['new reco'] = data[key]['recovered']
-
-        # Надобы обработать пропуск значений
-
-        for key in self.dict_of_data:
-            self.dict_of_data[key]['sick'] = (self.dict_of_data.get(
-                key - datetime.timedelta(days=1), {'sick': 0})['sick']
-                + self.dict_of_data[key]['new sick'])
-
-            self.dict_of_data[key]['S'] = self.dict_of_data.get(
-                key + datetime.timedelta(days=-1), {'S': 0})['S'] \
-                + self.dict_of_data[key]['new sick'] \
-                - self.dict_of_data[key]['new died'] \
-                - self.dict_of_data[key]['new reco'] \
+        self.dict_of_data = _table(*_cumulative_columns(data, self.fill))
+        self.last_date = max(self.dict_of_data)
 
         for key in self.dict_of_data:
             self.dict_of_data[key]['gamma'] = self.gamma
@@ -375,7 +959,27 @@ class NesterovConstantGamma(Approximator):
             self.dict_of_data[key]['l'] = self.l
             self.dict_of_data[key]['delta'] = self.delta
 
-    def predict(self, date):
+    def get_state(self):
+        r"""
+        Возвращает компактное состояние обученной модели: посчитанные
+        по выборке ряды.
+
+        :rtype: dict
+        """
+        return {'data': _dump_table(self.dict_of_data),
+                'last_date': self.last_date.strftime('%d.%m.%Y')}
+
+    def set_state(self, state):
+        r"""
+        Восстанавливает модель из состояния :meth:`get_state`.
+
+        :param state: словарь состояния модели
+        :type state: dict
+        """
+        self.dict_of_data = _load_table(state['data'])
+        self.last_date = _last_date(state, self.dict_of_data)
+
+    def predict(self, date, fields=None):
         r"""
         Данная функция должна возвращать предсказания для данной даты.
         Предсказывать нужно количество заболевших, выздоровших и умерших.
@@ -383,6 +987,9 @@ class NesterovConstantGamma(Approximator):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         return: ссловарь вида:
         {
             'date': строка в формате day.month.year,
@@ -436,12 +1043,13 @@ class NesterovConstantGamma(Approximator):
 
             cur_date = cur_date + datetime.timedelta(days=1)
 
-        return {'date': date.strftime('%d.%m.%Y'),
-                'sick': self.dict_of_data[date]['new sick'],
-                'recovered': self.dict_of_data[date]['new died'],
-                'died': self.dict_of_data[date]['new reco']}
+        return _select({'date': date.strftime('%d.%m.%Y'),
+                        'sick': self.dict_of_data[date]['new sick'],
+                        'recovered': self.dict_of_data[date]['new died'],
+                        'died': self.dict_of_data[date]['new reco']}, fields)
 
-    def predict_between(self, date_from, date_to):
+    @profiling.timed_method('predict_between')
+    def predict_between(self, date_from, date_to, fields=None):
         r"""
         Данная функция должна возвращать предсказания для всех дат между
             адаными.
@@ -450,6 +1058,9 @@ class NesterovConstantGamma(Approximator):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         :return: список словарей вида:
         {
             'date': строка в формате day.month.year,
@@ -466,24 +1077,67 @@ class NesterovConstantGamma(Approximator):
 
         list_of_ret = []
         while cur_date <= date_to:
-            pred = self.predict(cur_date.strftime('%d.%m.%Y'))
+            cancellation.check()
+            pred = self.predict(cur_date.strftime('%d.%m.%Y'), fields)
             cur_date = cur_date + datetime.timedelta(days=1)
 
             list_of_ret.append(pred)
 
         return list_of_ret
 
+    @profiling.timed_method('predict_interval')
+    def predict_interval(self, date_from, date_to, fields=None,
+                         quantiles=(0.05, 0.5, 0.95), samples=1000, seed=0,
+                         spread=0.1):
+        r"""
+        Интервальный прогноз для всех дат между заданными. Для каждой
+        траектории параметры gamma, k и l выбираются из логнормального
+        априорного распределения с медианой, равной параметру модели,
+        и стандартным отклонением логарифма spread; все траектории
+        считаются одним проходом по дням.
+
+        :param spread: стандартное отклонение логарифма параметров
+        :type spread: float
+
+        Остальные параметры и результат -- см.
+        :meth:`Approximator.predict_interval`.
+
+        :rtype: list
+        """
+        rng = np.random.default_rng(seed)
+        prior = np.array([self.gamma, self.k, self.l]) * np.exp(
+            spread * rng.standard_normal((samples, 3)))
+
+        def parameters(days):
+            return [np.broadcast_to(prior[:, [i]], (samples, days))
+                    for i in range(3)]
+
+        # поля сопоставлены столбцам так же, как в predict
+        return _nesterov_interval(
+            self, date_from, date_to, parameters,
+            {'sick': 'new sick', 'recovered': 'new died',
+             'died': 'new reco'}, fields, quantiles)
+
 
 class Nesterov(Approximator):
     r"""
     Реализация метода Нестерова, в случае фиксированого параметра \Delta
-    и предсказаний \gamma, k и l
+    и предсказаний \gamma, k и l.
+    При n_jobs > 1 модели ARIMA для \gamma, k и l обучаются параллельно.
+    Модель AR -- авторегрессия тех же порядков, что и у ARIMA, которая
+    обучается методом наименьших квадратов (см. :func:`_fit_ar`)
+    за миллисекунды.
     """
     _name = 'Модель Нестерова'
+    # порядок авторегрессии и число взятий разностей рядов в модели AR
+    AR_ORDERS = {'gamma': (6, 0), 'k': (5, 1), 'l': (6, 1)}
+    # сила регуляризации авторегрессии, см. :func:`_fit_ar`
+    AR_ALPHA = 0.1
     _parameters = {'model': {
-        'description': 'Модель предсказания: ARIMA',
+        'description': 'Модель предсказания: ARIMA либо AR (быстрая'
+                       ' авторегрессия, метод наименьших квадратов)',
         'type': 'choise',
-        'values': ['ARIMA'],
+        'values': ['ARIMA', 'AR'],
         'default': 'ARIMA',
         'min': None,
         'max': None},
@@ -494,11 +1148,14 @@ class Nesterov(Approximator):
             'values': [],
             'default': '14',
             'min': '1',
-            'max': '30'}}
+            'max': '30'},
+        'fill': _FILL_PARAMETER}
 
-    def __init__(self, delta=14, model='ARIMA'):
+    def __init__(self, delta=14, model='ARIMA', fill='linear', n_jobs=1):
         super(Nesterov, self).__init__()
 
+        self.n_jobs = int(n_jobs)
+
         self.delta = int(delta)
         if self.delta < int(self._parameters['delta']['min']):
             self.delta = int(self._parameters['delta']['min'])
@@ -510,6 +1167,12 @@ class Nesterov(Approximator):
         self.l_param = 0.03
 
         self.model = model
+        if self.model not in self._parameters['model']['values']:
+            self.model = self._parameters['model']['default']
+
+        self.fill = fill
+        if self.fill not in self._parameters['fill']['values']:
+            self.fill = self._parameters['fill']['default']
 
     def calculate_S(self, date):
         # S(d) = S(d - 1) + C(d) - D(d) - L(d)
@@ -519,32 +1182,75 @@ class Nesterov(Approximator):
                 - self.dict_of_data[date]['new died']
                 - self.dict_of_data[date]['new reco'])
 
-    def calculate_gamma(self, key):
-        # gamma(d) = C(d + \delta) / (T(d + \delta - 1) - T(d - 1))
-        delta = self.dict_of_data[key]['delta']
-        return (self.dict_of_data[key + datetime.timedelta(days=delta)]
-                ['new sick']
-                / (self.dict_of_data[key + datetime.timedelta(days=delta - 1)]
-                   ['sick'] - self.dict_of_data.get(
-                   key + datetime.timedelta(days=-1), {'sick': 0})['sick'])
-                )
-
-    def calculate_k_and_l(self, key):
-        # k(d) = D(d) / S(d - 1)
-        # l(d) = R(d) / S(d - 1)
-        def calc(value):
-            return (value / S_prev) if S_prev != 0 else 0
-
-        S_prev = self.dict_of_data.get(key + datetime.timedelta(days=-1),
-                                       {'S': 0})['S']
-        self.dict_of_data[key]['k'] = calc(self.dict_of_data[key]['new died'])
-        self.dict_of_data[key]['l'] = calc(self.dict_of_data[key]['new reco'])
+    @staticmethod
+    def calculate_gamma(new_sick, sick, delta):
+        r"""
+        Оценивает gamma по всем дням выборки сразу:
+
+            gamma(d) = C(d + \delta) / (T(d + \delta - 1) - T(d - 1))
+
+        gamma не определена для последних \delta дней выборки и для дней
+        с нулевым знаменателем.
 
+        :param new_sick: число новых заболевших C по дням
+        :type new_sick: numpy.ndarray
+
+        :param sick: накопленное число заболевших T по дням
+        :type sick: numpy.ndarray
+
+        :return: массив gamma (0 там, где она не определена) и маска дней,
+            для которых gamma определена
+        :rtype: tuple
+        """
+        gamma = np.zeros(len(sick))
+        mask = np.zeros(len(sick), dtype=bool)
+        days = max(len(sick) - delta, 0)
+        if days:
+            # T(d - 1), T(-1) = 0
+            previous = np.concatenate(([0], sick[:days - 1]))
+            denominator = sick[delta - 1:delta - 1 + days] - previous
+            mask[:days] = denominator != 0
+            np.divide(new_sick[delta:delta + days], denominator,
+                      out=gamma[:days], where=mask[:days])
+        return gamma, mask
+
+    @staticmethod
+    def calculate_k_and_l(new_died, new_reco, S):
+        r"""
+        Оценивает k и l по всем дням выборки сразу:
+
+            k(d) = D(d) / S(d - 1)
+
+            l(d) = R(d) / S(d - 1)
+
+        При S(d - 1) = 0 (в том числе для первого дня) k и l равны 0.
+
+        :param new_died: число новых умерших D по дням
+        :type new_died: numpy.ndarray
+
+        :param new_reco: число новых выздоровевших R по дням
+        :type new_reco: numpy.ndarray
+
+        :param S: число болеющих по дням
+        :type S: numpy.ndarray
+
+        :return: массивы k и l и маска дней с ненулевым S(d - 1)
+        :rtype: tuple
+        """
+        previous = np.concatenate(([0], S[:-1]))
+        mask = previous != 0
+        k = np.zeros(len(S))
+        l_coef = np.zeros(len(S))
+        np.divide(new_died, previous, out=k, where=mask)
+        np.divide(new_reco, previous, out=l_coef, where=mask)
+        return k, l_coef, mask
+
+    @profiling.timed_method('fit')
     def fit(self, data):
         r"""
         Данная функция должна аппроксимировать выборку для полученных данных.
         Под аппроксимацией подрозумевается настройка всех параметров модели.
-        Предполагается, что все дни представлены в выборки.
+        Пропущенные дни заполняются согласно параметру fill.
 
         :param data: Словарь вида
                 key - номер объекта,
@@ -554,58 +1260,178 @@ class Nesterov(Approximator):
                                'died': int}
         :type data: dict
         """
+        dates, columns = _cumulative_columns(data, self.fill)
+        self.last_date = dates[-1]
+
+        gamma, gamma_mask = self.calculate_gamma(
+            columns['new sick'], columns['sick'], self.delta)
+        columns['k'], columns['l'], _ = self.calculate_k_and_l(
+            columns['new died'], columns['new reco'], columns['S'])
+        columns['delta'] = np.full(len(dates), self.delta)
+
+        self.dict_of_data = _table(dates, columns)
+        gamma_days = np.flatnonzero(gamma_mask).tolist()
+        gammas = gamma[gamma_mask].tolist()
+        for day, value in zip(gamma_days, gammas):
+            self.dict_of_data[dates[day]]['gamma'] = value
+
+        ds = columns['k'].tolist()
+        ls = columns['l'].tolist()
+        if self.model == 'AR':
+            self._fit_ar(dates, gamma_days, gammas, ds, ls)
+            for key in self.dict_of_data:
+                self.predict_params(key)
+            return
 
-        self.dict_of_data = dict()
-
-        for key in data:
-            date = datetime.datetime.strptime(data[key]['date'],
-                                              '%d.%m.%Y').date()
-            if date not in self.dict_of_data:
-                self.dict_of_data[date] = dict()
-            self.dict_of_data[date]['new sick'] = data[key]['sick']
-            self.dict_of_data[date]['new died'] = data[key]['died']
-            self.dict_of_data[date]['new reco'] = data[key]['recovered']
+        g_dates = [dates[day].strftime('%Y-%m-%d') for day in gamma_days]
+        dl_dates = [date.strftime('%Y-%m-%d') for date in dates]
+        self.arima_data = {
+            'gamma': {'index': g_dates, 'endog': gammas,
+                      'order': (6, 0, 4)},
+            'k': {'index': dl_dates, 'endog': ds, 'order': (5, 1, 4)},
+            'l': {'index': dl_dates, 'endog': ls, 'order': (6, 1, 6)}}
 
-        # Надо бы обработать пропуск значений
+        self.gamma_model, self.d_model, self.l_model = _map(
+            self._fit_arima,
+            [self.arima_data[name] for name in ('gamma', 'k', 'l')],
+            self.n_jobs, preload=('pandas', 'statsmodels.tsa.arima.model'))
 
         for key in self.dict_of_data:
-            self.dict_of_data[key]['sick'] = (self.dict_of_data.get(
-                key - datetime.timedelta(days=1), {'sick': 0})['sick']
-                + self.dict_of_data[key]['new sick'])
+            self.predict_params(key)
+
+    def _fit_ar(self, dates, gamma_days, gammas, ds, ls):
+        r"""
+        Обучает авторегрессии для \gamma (по дням, где она определена),
+        k и l. \gamma внутри выборки, где она не определена, заполняется
+        прогнозом на один шаг по предыдущим значениям.
+        """
+        last_gamma = (dates[gamma_days[-1]] if gamma_days
+                      else dates[0] - datetime.timedelta(days=1))
+        self.ar_models = {
+            'gamma': _fit_ar(gammas, *self.AR_ORDERS['gamma'],
+                             alpha=self.AR_ALPHA, default=self.gamma),
+            'k': _fit_ar(ds, *self.AR_ORDERS['k'], alpha=self.AR_ALPHA),
+            'l': _fit_ar(ls, *self.AR_ORDERS['l'], alpha=self.AR_ALPHA)}
+        self.ar_models['gamma']['last'] = last_gamma.strftime('%Y-%m-%d')
+        for name in ('k', 'l'):
+            self.ar_models[name]['last'] = dates[-1].strftime('%Y-%m-%d')
+        self.ar_paths = dict()
+
+        observed = 0
+        for day, date in enumerate(dates):
+            if date > last_gamma:
+                break
+            if observed < len(gamma_days) and gamma_days[observed] == day:
+                observed += 1
+            else:
+                self.dict_of_data[date]['gamma'] = _predict_ar(
+                    self.ar_models['gamma'], gammas[:observed])
+
+    def _predict_ar(self, name, date):
+        r"""
+        Прогноз авторегрессии параметра name на дату после конца ее
+        выборки. Прогноз считается сразу на несколько дней вперед
+        и запоминается.
+        """
+        ar = self.ar_models[name]
+        step = (date - datetime.datetime.strptime(
+            ar['last'], '%Y-%m-%d').date()).days
+        path = self.ar_paths.get(name, [])
+        if len(path) < step:
+            path = _simulate_ar(ar, max(step, 2 * len(path), 32))[0].tolist()
+            self.ar_paths[name] = path
+        return path[step - 1]
+
+    def _simulate(self, name, steps, samples, rng):
+        r"""
+        Выбирает samples траекторий параметра name (gamma, k либо l)
+        на steps дней после конца выборки его модели.
+
+        :rtype: numpy.ndarray
+        """
+        if self.model == 'AR':
+            return _simulate_ar(self.ar_models[name], steps, samples, rng)
+        return _simulate_arima({'gamma': self.gamma_model, 'k': self.d_model,
+                                'l': self.l_model}[name], steps, samples, rng)
+
+    def _last_gamma(self):
+        r"""Последний день выборки модели \gamma."""
+        if self.model == 'AR':
+            last = self.ar_models['gamma']['last']
+        else:
+            last = self.arima_data['gamma']['index'][-1]
+        return datetime.datetime.strptime(last, '%Y-%m-%d').date()
+
+    @staticmethod
+    def _make_arima(data):
+        import pandas as pd
+        from statsmodels.tsa.arima.model import ARIMA
+
+        return ARIMA(pd.Series(data['endog'], index=data['index']),
+                     order=tuple(data['order']), trend='n')
+
+    @staticmethod
+    def _fit_arima(data):
+        return Nesterov._make_arima(data).fit()
+
+    def get_state(self):
+        r"""
+        Возвращает компактное состояние обученной модели: посчитанные
+        по выборке ряды, а также входные ряды и параметры моделей ARIMA
+        (без служебных матриц результатов statsmodels) либо авторегрессии
+        модели AR.
 
+        :rtype: dict
+        """
+        state = {'data': _dump_table(self.dict_of_data),
+                 'last_date': self.last_date.strftime('%d.%m.%Y')}
         if self.model == 'ARIMA':
-            for key in self.dict_of_data:
-                self.dict_of_data[key]['delta'] = self.delta
-                try:
-                    self.dict_of_data[key]['gamma'] = self.calculate_gamma(key)
-                except Exception:
-                    pass
-
-                self.dict_of_data[key]['S'] = self.calculate_S(key)
-                self.calculate_k_and_l(key)
-
-            gammas = [self.dict_of_data[key]['gamma'] for key in
-                      self.dict_of_data if 'gamma' in self.dict_of_data[key]]
-            g_dates = [key.strftime('%Y-%m-%d') for key in self.dict_of_data if
-                       'gamma' in self.dict_of_data[key]]
-            ds = [self.dict_of_data[key]['k'] for key in self.dict_of_data if
-                  'k' in self.dict_of_data[key]]
-            ls = [self.dict_of_data[key]['l'] for key in self.dict_of_data if
-                  'l' in self.dict_of_data[key]]
-            dl_dates = [key.strftime('%Y-%m-%d') for key in self.dict_of_data if
-                        'k' in self.dict_of_data[key]]
-
-            self.gamma_model = ARIMA(pd.Series(gammas, index=g_dates),
-                                     order=(6, 0, 4), trend='n').fit()
-            self.d_model = ARIMA(pd.Series(ds, index=dl_dates),
-                                 order=(5, 1, 4), trend='n').fit()
-            self.l_model = ARIMA(pd.Series(ls, index=dl_dates),
-                                 order=(6, 1, 6), trend='n').fit()
+            state['arima'] = dict()
+            for name, result in (('gamma', self.gamma_model),
+                                 ('k', self.d_model),
+                                 ('l', self.l_model)):
+                state['arima'][name] = {
+                    'index': list(self.arima_data[name]['index']),
+                    'endog': [_to_builtin(value) for value in
+                              self.arima_data[name]['endog']],
+                    'order': list(self.arima_data[name]['order']),
+                    'params': np.asarray(result.params).tolist()}
+        elif self.model == 'AR':
+            state['ar'] = self.ar_models
+        return state
+
+    def set_state(self, state):
+        r"""
+        Восстанавливает модель из состояния :meth:`get_state`. Модели ARIMA
+        не обучаются заново, а только фильтруются с сохраненными
+        параметрами.
 
-            for key in self.dict_of_data:
-                self.predict_params(key)
+        :param state: словарь состояния модели
+        :type state: dict
+        """
+        self.dict_of_data = _load_table(state['data'])
+        self.last_date = _last_date(state, self.dict_of_data)
+        if 'arima' in state:
+            self.arima_data = {name: {'index': state['arima'][name]['index'],
+                                      'endog': state['arima'][name]['endog'],
+                                      'order': state['arima'][name]['order']}
+                               for name in state['arima']}
+            self.gamma_model, self.d_model, self.l_model = [
+                self._make_arima(self.arima_data[name]).filter(
+                    state['arima'][name]['params'])
+                for name in ('gamma', 'k', 'l')]
+        if 'ar' in state:
+            self.ar_models = state['ar']
+            self.ar_paths = dict()
 
     def predict_params(self, date):
+        if self.model == 'AR':
+            for name in ('gamma', 'k', 'l'):
+                if name not in self.dict_of_data[date]:
+                    self.dict_of_data[date][name] = self._predict_ar(
+                        name, date)
+            return
+
         date_str = date.strftime('%Y-%m-%d')
         if 'gamma' not in self.dict_of_data[date]:
             self.dict_of_data[date]['gamma'] = \
@@ -620,7 +1446,7 @@ class Nesterov(Approximator):
                 self.l_model.predict(start=date_str,
                                      end=date_str).values[0]
 
-    def predict(self, date):
+    def predict(self, date, fields=None):
         r"""
         Данная функция должна возвращать предсказания для данной даты.
         Предсказывать нужно количество заболевших, выздоровших и умерших.
@@ -628,6 +1454,9 @@ class Nesterov(Approximator):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         return: ссловарь вида:
         {
             'date': строка в формате day.month.year,
@@ -674,12 +1503,13 @@ class Nesterov(Approximator):
 
             cur_date = cur_date + datetime.timedelta(days=1)
 
-        return {'date': date.strftime('%d.%m.%Y'),
-                'sick': self.dict_of_data[date]['new sick'],
-                'recovered': self.dict_of_data[date]['new reco'],
-                'died': self.dict_of_data[date]['new died']}
+        return _select({'date': date.strftime('%d.%m.%Y'),
+                        'sick': self.dict_of_data[date]['new sick'],
+                        'recovered': self.dict_of_data[date]['new reco'],
+                        'died': self.dict_of_data[date]['new died']}, fields)
 
-    def predict_between(self, date_from, date_to):
+    @profiling.timed_method('predict_between')
+    def predict_between(self, date_from, date_to, fields=None):
         r"""
         Данная функция должна возвращать предсказания для всех дат между
             адаными.
@@ -688,6 +1518,9 @@ class Nesterov(Approximator):
         :param date: Строка формата "day.month.year"
         :type date: str
 
+        :param fields: поля, которые нужно предсказать (по умолчанию все)
+        :type fields: list
+
         :return: список словарей вида:
         {
             'date': строка в формате day.month.year,
@@ -704,9 +1537,52 @@ class Nesterov(Approximator):
 
         list_of_ret = []
         while cur_date <= date_to:
-            pred = self.predict(cur_date.strftime('%d.%m.%Y'))
+            cancellation.check()
+            pred = self.predict(cur_date.strftime('%d.%m.%Y'), fields)
             cur_date = cur_date + datetime.timedelta(days=1)
 
             list_of_ret.append(pred)
 
         return list_of_ret
+
+    @profiling.timed_method('predict_interval')
+    def predict_interval(self, date_from, date_to, fields=None,
+                         quantiles=(0.05, 0.5, 0.95), samples=1000, seed=0):
+        r"""
+        Интервальный прогноз для всех дат между заданными. Траектории
+        gamma, k и l выбираются из прогнозных распределений моделей ARIMA
+        либо AR (см. :func:`_simulate_arima`, :func:`_simulate_ar`), как
+        и в точечном прогнозе, без
+        ограничения диапазона. gamma(d - \delta) для дней, попавших
+        в выборку модели gamma, берется из таблицы. Все траектории
+        считаются одним проходом по дням.
+
+        Параметры и результат -- см. :meth:`Approximator.predict_interval`.
+
+        :rtype: list
+        """
+        rng = np.random.default_rng(seed)
+
+        def parameters(days):
+            first = self.last_date + datetime.timedelta(days=1 - self.delta)
+            last_gamma = self._last_gamma()
+            simulated = self._simulate(
+                'gamma', max((first - last_gamma).days + days - 1, 0),
+                samples, rng)
+
+            gamma = np.empty((samples, days))
+            for day in range(days):
+                date = first + datetime.timedelta(days=day)
+                if date <= last_gamma:
+                    gamma[:, day] = self.dict_of_data.get(
+                        date, {'gamma': self.gamma})['gamma']
+                else:
+                    gamma[:, day] = simulated[:, (date - last_gamma).days - 1]
+            k = self._simulate('k', days, samples, rng)
+            l_coef = self._simulate('l', days, samples, rng)
+            return gamma, k, l_coef
+
+        return _nesterov_interval(
+            self, date_from, date_to, parameters,
+            {'sick': 'new sick', 'recovered': 'new reco',
+             'died': 'new died'}, fields, quantiles)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import threading
+import time
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    r"""
+    Вычисление было отменено.
+
+    :param reason: причина отмены, например deadline или disconnect
+    :type reason: str
+    """
+
+    def __init__(self, reason):
+        super(Cancelled, self).__init__(reason)
+        self.reason = reason
+
+
+class CancelToken(object):
+    r"""
+    Признак отмены вычисления. Вычисление считается отмененным, если был
+    вызван :meth:`cancel`, прошел deadline либо probe вернул причину отмены.
+
+    :param deadline: время (по time.monotonic) после которого вычисление
+        отменяется
+    :type deadline: float
+
+    :param probe: функция без аргументов, возвращающая причину отмены либо
+        None; вызывается не чаще, чем раз в probe_interval секунд
+    :type probe: callable
+
+    :param isolate: выполнять ли долгие обучения в отдельных процессах,
+        чтобы их можно было прервать
+    :type isolate: bool
+    """
+
+    def __init__(self, deadline=None, probe=None, probe_interval=0.5,
+                 isolate=False):
+        self.deadline = deadline
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.isolate = isolate
+
+        self._reason = None
+        self._probed = None
+
+    def cancel(self, reason='cancelled'):
+        if self._reason is None:
+            self._reason = reason
+
+    def reason(self):
+        r"""
+        Возвращает причину отмены либо None, если вычисление не отменено.
+
+        :rtype: str
+        """
+        if self._reason is not None:
+            return self._reason
+
+        now = time.monotonic()
+        if self.deadline is not None and now > self.deadline:
+            self.cancel('deadline')
+        elif self.probe is not None and (
+                self._probed is None
+                or now - self._probed >= self.probe_interval):
+            self._probed = now
+            reason = self.probe()
+            if reason is not None:
+                self.cancel(reason)
+        return self._reason
+
+    def check(self):
+        r"""Бросает :class:`Cancelled`, если вычисление отменено."""
+        reason = self.reason()
+        if reason is not None:
+            raise Cancelled(reason)
+
+
+def current():
+    r"""
+    Возвращает признак отмены текущего потока либо None.
+
+    :rtype: CancelToken
+    """
+    return getattr(_local, 'token', None)
+
+
+def reset():
+    r"""Убирает признак отмены текущего потока (например, в дочернем
+    процессе при его запуске)."""
+    _local.token = None
+
+
+@contextmanager
+def scope(token):
+    r"""
+    Контекстный менеджер, в котором вычисления текущего потока проверяют
+    признак отмены token.
+
+    :type token: CancelToken
+    """
+    previous = current()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def check():
+    r"""
+    Бросает :class:`Cancelled`, если вычисление текущего потока отменено.
+    Вне :func:`scope` ничего не делает.
+    """
+    token = current()
+    if token is not None:
+        token.check()
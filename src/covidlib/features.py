@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+r"""
+Признаки региона, которые нужны моделям при обучении: ряды на непрерывной
+сетке дней, накопленные суммы, число болеющих, средние за неделю и ось
+дней. Признаки считаются один раз на версию данных региона
+(см. :func:`api.get_features`) и передаются в
+:meth:`covidlib.approximator.Approximator.fit` вместо данных, так что
+запрос с несколькими моделями готовит данные один раз.
+"""
+import datetime
+
+import numpy as np
+
+# день 0 оси дней
+EPOCH = datetime.date(1970, 1, 1)
+
+# ширина окна скользящего среднего, дней
+ROLLING_DAYS = 7
+
+
+def _freeze(array):
+    array.flags.writeable = False
+    return array
+
+
+def _rolling_mean(values, days=ROLLING_DAYS):
+    r"""
+    Среднее за последние days дней (в первые дни ряда -- за все дни
+    с начала ряда).
+    """
+    cumulative = np.concatenate(([0], np.cumsum(values, dtype=np.float64)))
+    index = np.arange(1, len(values) + 1)
+    start = np.maximum(index - days, 0)
+    return (cumulative[index] - cumulative[start]) / (index - start)
+
+
+class FeatureFrame(object):
+    r"""
+    Признаки региона, построенные по выборке в формате
+    :meth:`covidlib.approximator.Approximator.fit`. Объект не изменяется
+    после создания: массивы доступны только для чтения, а производные
+    столбцы считаются при первом обращении и запоминаются.
+
+    :param days: дни выборки по оси дней (номер дня от :data:`EPOCH`)
+        по возрастанию
+    :type days: numpy.ndarray
+
+    :param values: массив размера (дни, 3) -- число новых заболевших,
+        умерших и выздоровевших за каждый день выборки
+    :type values: numpy.ndarray
+    """
+    FIELDS = ('sick', 'died', 'recovered')
+
+    def __init__(self, days, values):
+        self.days = _freeze(np.asarray(days, dtype=np.int64))
+        self.values = _freeze(np.asarray(
+            values, dtype=np.int64).reshape(len(self.days), len(self.FIELDS)))
+        self._grids = dict()
+        self._timestamps = None
+
+    @classmethod
+    def from_data(cls, data):
+        r"""
+        Строит признаки по выборке data (даты разбираются один раз). Если
+        день повторяется, берется последняя запись.
+
+        :param data: выборка в формате
+            :meth:`covidlib.approximator.Approximator.fit`
+        :type data: dict
+
+        :rtype: FeatureFrame
+        """
+        values = dict()
+        for key in data:
+            day = datetime.datetime.strptime(
+                data[key]['date'], '%d.%m.%Y').date().toordinal()
+            values[day - EPOCH.toordinal()] = [
+                data[key][field] for field in cls.FIELDS]
+        days = sorted(values)
+        return cls(days, [values[day] for day in days])
+
+    def __len__(self):
+        return len(self.days)
+
+    @staticmethod
+    def to_day(date):
+        r"""
+        Переводит дату (строку формата day.month.year либо
+        datetime.date) в номер дня на оси дней.
+
+        :rtype: int
+        """
+        if isinstance(date, str):
+            date = datetime.datetime.strptime(date, '%d.%m.%Y').date()
+        return date.toordinal() - EPOCH.toordinal()
+
+    @staticmethod
+    def to_date(day):
+        r"""
+        Переводит номер дня на оси дней в дату.
+
+        :rtype: datetime.date
+        """
+        return EPOCH + datetime.timedelta(days=int(day))
+
+    def window(self, date_from, date_to):
+        r"""
+        Возвращает признаки дней выборки с date_from по date_to включительно
+        (как у выборки, обрезанной :func:`api.prune_data`). Накопленные
+        суммы окна отсчитываются от его начала.
+
+        :param date_from: строка формата "day.month.year"
+        :type date_from: str
+
+        :param date_to: строка формата "day.month.year"
+        :type date_to: str
+
+        :rtype: FeatureFrame
+        """
+        mask = ((self.days >= self.to_day(date_from))
+                & (self.days <= self.to_day(date_to)))
+        return FeatureFrame(self.days[mask], self.values[mask])
+
+    def dates(self):
+        r"""
+        Возвращает дни выборки.
+
+        :rtype: list
+        """
+        return [self.to_date(day) for day in self.days.tolist()]
+
+    def observed(self, field):
+        r"""
+        Возвращает значения поля field (sick, died либо recovered) по дням
+        выборки.
+
+        :rtype: list
+        """
+        return self.values[:, self.FIELDS.index(field)].tolist()
+
+    def timestamps(self):
+        r"""
+        Возвращает метки времени (начало дня по местному времени, как
+        datetime.timestamp()) дней выборки.
+
+        :rtype: numpy.ndarray
+        """
+        if self._timestamps is None:
+            self._timestamps = _freeze(np.array(
+                [datetime.datetime.combine(date, datetime.time()).timestamp()
+                 for date in self.dates()]))
+        return self._timestamps
+
+    def grid(self, fill='linear'):
+        r"""
+        Возвращает признаки на непрерывной сетке дней: от первого до
+        последнего дня выборки без пропусков. Пропущенные дни заполняются
+        линейной интерполяцией соседних дней, округленной до целого
+        (fill='linear'), либо нулями (fill='zero').
+
+        Столбцы: day -- ось дней; new sick, new died, new reco -- число
+        новых заболевших C, умерших D и выздоровевших R; sick, died,
+        recovered -- накопленные суммы, например T(d) = T(d - 1) + C(d);
+        S -- число болеющих S(d) = S(d - 1) + C(d) - D(d) - R(d);
+        new sick 7d, new died 7d, new reco 7d -- средние за неделю.
+
+        :return: список дат сетки и словарь столбцов (массивов только
+            для чтения)
+        :rtype: tuple
+        """
+        if fill not in self._grids:
+            self._grids[fill] = self._grid(fill)
+        dates, columns = self._grids[fill]
+        return list(dates), dict(columns)
+
+    def _grid(self, fill):
+        if not len(self.days):
+            raise ValueError('no data')
+
+        first = int(self.days[0])
+        days = np.arange(first, int(self.days[-1]) + 1)
+        offsets = self.days - first
+
+        grid = np.zeros((len(days), len(self.FIELDS)), dtype=np.int64)
+        if fill == 'linear' and len(self.days) < len(days):
+            for column in range(len(self.FIELDS)):
+                grid[:, column] = np.rint(np.interp(
+                    np.arange(len(days)), offsets, self.values[:, column]))
+        grid[offsets] = self.values
+
+        new_sick, new_died, new_reco = grid.T
+        columns = {'day': days,
+                   'new sick': new_sick,
+                   'new died': new_died,
+                   'new reco': new_reco,
+                   'sick': np.cumsum(new_sick),
+                   'died': np.cumsum(new_died),
+                   'recovered': np.cumsum(new_reco),
+                   'S': np.cumsum(new_sick - new_died - new_reco),
+                   'new sick 7d': _rolling_mean(new_sick),
+                   'new died 7d': _rolling_mean(new_died),
+                   'new reco 7d': _rolling_mean(new_reco)}
+        for name in columns:
+            columns[name] = _freeze(np.ascontiguousarray(columns[name]))
+        return [self.to_date(day) for day in days.tolist()], columns
+
+
+def to_frame(data):
+    r"""
+    Возвращает признаки выборки data; если data -- уже
+    :class:`FeatureFrame`, возвращает ее саму.
+
+    :rtype: FeatureFrame
+    """
+    if isinstance(data, FeatureFrame):
+        return data
+    return FeatureFrame.from_data(data)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+STAGE_METRIC = 'covid_stage_seconds'
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+
+# name -> (type, help)
+_metrics = {STAGE_METRIC: ('summary', 'Time spent in a stage of the request')}
+# (name, labels) -> [count, sum] для summary и value для counter и gauge
+_values = dict()
+
+
+def enable(flag=True):
+    r"""Включает (или выключает) таймеры этапов."""
+    global _enabled
+    _enabled = bool(flag)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def describe(name, type_, help_=''):
+    r"""
+    Регистрирует метрику, чтобы у нее были TYPE и HELP в выводе.
+
+    :param type_: counter, gauge либо summary
+    :type type_: str
+    """
+    _metrics[name] = (type_, help_)
+
+
+def inc(name, value=1, **labels):
+    r"""Увеличивает счетчик name на value."""
+    key = (name, _labels(labels))
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    r"""Устанавливает текущее значение метрики name."""
+    with _lock:
+        _values[(name, _labels(labels))] = value
+
+
+def observe(name, value, **labels):
+    r"""Добавляет наблюдение value в summary метрику name."""
+    key = (name, _labels(labels))
+    with _lock:
+        count_sum = _values.setdefault(key, [0, 0.0])
+        count_sum[0] += 1
+        count_sum[1] += value
+
+
+def _record(stage, seconds, labels):
+    observe(STAGE_METRIC, seconds, stage=stage, **labels)
+    records = getattr(_local, 'records', None)
+    if records is not None:
+        records.append((stage, labels, seconds))
+
+
+@contextmanager
+def timer(stage, **labels):
+    r"""
+    Контекстный менеджер, замеряющий время выполнения этапа stage.
+
+    :param stage: название этапа
+    :type stage: str
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(stage, time.perf_counter() - start, labels)
+
+
+def timed_method(stage):
+    r"""
+    Декоратор метода, замеряющий время его выполнения. Имя класса
+    объекта попадает в метку model.
+
+    :param stage: название этапа
+    :type stage: str
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not _enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _record(stage, time.perf_counter() - start,
+                        {'model': type(self).__name__})
+        return wrapper
+    return decorator
+
+
+def begin_collect():
+    r"""
+    Начинает сбор замеров этапов в текущем потоке (например, для одного
+    запроса). Замеры возвращает :func:`end_collect`.
+    """
+    _local.records = []
+
+
+def end_collect():
+    r"""
+    Заканчивает сбор замеров в текущем потоке.
+
+    :return: список кортежей (этап, метки, секунды)
+    :rtype: list
+    """
+    records = getattr(_local, 'records', None)
+    _local.records = None
+    return records or []
+
+
+def format_timing(records):
+    r"""
+    Форматирует замеры из :func:`end_collect` для заголовка ответа,
+    например ``fit[Nesterov]=702.4ms, serialization=1.2ms``.
+
+    :rtype: str
+    """
+    return ', '.join(
+        '{}={:.1f}ms'.format(_stage_name(stage, labels), seconds * 1000)
+        for stage, labels, seconds in records)
+
+
+def timing_fields(records):
+    r"""
+    Переводит замеры из :func:`end_collect` в словарь
+    {этап: миллисекунды} для структурированного журнала (этапы называются
+    как в :func:`format_timing`, замеры одного этапа складываются).
+
+    :rtype: dict
+    """
+    fields = dict()
+    for stage, labels, seconds in records:
+        name = _stage_name(stage, labels)
+        fields[name] = fields.get(name, 0.0) + seconds * 1000
+    return {name: round(value, 1) for name, value in fields.items()}
+
+
+def _stage_name(stage, labels):
+    if not labels:
+        return stage
+    return '{}[{}]'.format(
+        stage, ','.join(str(labels[key]) for key in sorted(labels)))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', "'"))
+                          for key, value in labels) + '}'
+
+
+def render_prometheus():
+    r"""
+    Возвращает все метрики в текстовом формате Prometheus.
+
+    :rtype: str
+    """
+    with _lock:
+        values = sorted((key, list(value) if isinstance(value, list)
+                         else value) for key, value in _values.items())
+
+    lines = []
+    described = set()
+    for (name, labels), value in values:
+        type_, help_ = _metrics.get(name, ('untyped', ''))
+        if name not in described:
+            described.add(name)
+            if help_:
+                lines.append('# HELP {} {}'.format(name, help_))
+            lines.append('# TYPE {} {}'.format(name, type_))
+        if type_ == 'summary':
+            lines.append('{}_count{} {}'.format(
+                name, _format_labels(labels), value[0]))
+            lines.append('{}_sum{} {}'.format(
+                name, _format_labels(labels), value[1]))
+        else:
+            lines.append('{}{} {}'.format(
+                name, _format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+
+from . import approximator
+
+
+class ModelRegistry(object):
+    r"""
+    Хранилище обученных аппроксиматоров.
+
+    Модель сохраняется в компактном виде (см. :meth:`Approximator.get_state`)
+    под ключом, который однозначно задается регионом, классом модели,
+    нормализованными параметрами, окном обучения и версией данных.
+    Записи хранятся в памяти (не более ``max_loaded`` штук) и, если задан
+    ``path``, на диске в виде ``path/<регион>/<ключ>.json``. С диска записи
+    подгружаются лениво, только при первом обращении.
+    """
+
+    def __init__(self, path=None, max_loaded=1024):
+        self.path = Path(path) if path is not None else None
+        self.max_loaded = max_loaded
+
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(region, model, parameters, date_from, date_to, version):
+        r"""
+        Возвращает ключ записи в хранилище.
+
+        :param region: код региона
+        :type region: str
+        :param model: имя класса модели
+        :type model: str
+        :param parameters: нормализованные параметры модели
+            (см. :meth:`Approximator.get_parameters`)
+        :type parameters: dict
+        :param date_from: начало окна обучения в формате day.month.year
+        :type date_from: str
+        :param date_to: конец окна обучения в формате day.month.year
+        :type date_to: str
+        :param version: версия данных региона
+        :type version: str
+
+        :rtype: str
+        """
+        canonical = json.dumps([region, model, parameters, date_from, date_to,
+                                version], sort_keys=True)
+        return '{}-{}'.format(
+            region, hashlib.sha1(canonical.encode('utf-8')).hexdigest())
+
+    def _file(self, key):
+        return self.path / key.rsplit('-', 1)[0] / '{}.json'.format(key)
+
+    def _remember(self, key, record):
+        with self._lock:
+            self._records[key] = record
+            self._records.move_to_end(key)
+            while len(self._records) > self.max_loaded:
+                self._records.popitem(last=False)
+
+    def _record(self, key):
+        with self._lock:
+            if key in self._records:
+                self._records.move_to_end(key)
+                return self._records[key]
+
+        if self.path is None:
+            return None
+        try:
+            with open(self._file(key)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, record)
+        return record
+
+    def __contains__(self, key):
+        return self._record(key) is not None
+
+    def put(self, key, model):
+        r"""
+        Сохраняет обученную модель в хранилище.
+
+        :param key: ключ, полученный из :meth:`make_key`
+        :type key: str
+        :param model: обученная модель
+        :type model: Approximator
+        """
+        record = {'class': type(model).__name__,
+                  'parameters': model.get_parameters(),
+                  'state': model.get_state()}
+        self._remember(key, record)
+
+        if self.path is not None:
+            file = self._file(key)
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # у каждой записи свой временный файл: одну модель могут
+            # одновременно записывать несколько потоков и процессов
+            fd, tmp = tempfile.mkstemp(dir=str(file.parent), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(record, f, separators=(',', ':'))
+                os.replace(tmp, str(file))
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+    def get(self, key):
+        r"""
+        Возвращает новый экземпляр обученной модели либо None, если
+        записи с таким ключом нет.
+
+        :param key: ключ, полученный из :meth:`make_key`
+        :type key: str
+
+        :rtype: Approximator
+        """
+        record = self._record(key)
+        if record is None:
+            return None
+
+        model = getattr(approximator, record['class'])(**record['parameters'])
+        model.set_state(record['state'])
+        return model
+
+    def drop(self, region):
+        r"""
+        Удаляет все записи для данного региона, например после обновления
+        его данных.
+
+        :param region: код региона
+        :type region: str
+        """
+        with self._lock:
+            for key in [key for key in self._records
+                        if key.rsplit('-', 1)[0] == region]:
+                del self._records[key]
+
+        if self.path is not None:
+            shutil.rmtree(self.path / region, ignore_errors=True)
+
+    def clear(self):
+        r"""
+        Удаляет все записи, например после пересоздания базы: версии данных
+        новой базы могут совпасть с версиями, на которых обучены записи.
+        """
+        with self._lock:
+            self._records.clear()
+
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)